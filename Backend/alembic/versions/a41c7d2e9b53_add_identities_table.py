@@ -0,0 +1,49 @@
+"""Add identities table (email -> account index) and merge heads
+
+Revision ID: a41c7d2e9b53
+Revises: 89e3a2957fb7, f2b61c9a8c11
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41c7d2e9b53'
+down_revision: Union[str, Sequence[str], None] = ('89e3a2957fb7', 'f2b61c9a8c11')
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+_ACCOUNT_TABLES = (("owner", "owners"), ("coach", "coaches"), ("student", "students"))
+
+
+def upgrade() -> None:
+    op.create_table(
+        'identities',
+        sa.Column('id', sa.Integer(), primary_key=True, nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('user_type', sa.String(length=20), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint('user_type', 'user_id', name='uq_identities_user'),
+    )
+    op.create_index('ix_identities_id', 'identities', ['id'])
+    op.create_index('ix_identities_email', 'identities', ['email'])
+
+    # Backfill existing accounts
+    for user_type, table_name in _ACCOUNT_TABLES:
+        op.execute(
+            f"INSERT INTO identities (email, user_type, user_id, status, locked_until) "
+            f"SELECT email, '{user_type}', id, status, locked_until FROM {table_name}"
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_identities_email', table_name='identities')
+    op.drop_index('ix_identities_id', table_name='identities')
+    op.drop_table('identities')
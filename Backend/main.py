@@ -6,7 +6,7 @@ from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Red
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 import mimetypes
-from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, Boolean, Text, Date, DateTime, ForeignKey, JSON, func, and_, or_, select, TypeDecorator
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, Boolean, Text, Date, DateTime, ForeignKey, JSON, func, and_, or_, select, TypeDecorator, UniqueConstraint
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.exc import IntegrityError
@@ -17,14 +17,22 @@ import re
 from typing import List, Optional, Dict, Any, Union, Annotated, Literal
 from datetime import datetime, date, timedelta
 from calendar import monthrange
+from collections import defaultdict
 import json
 import os
 import shutil
 import uuid
 import secrets
+import asyncio
+import queue
+import threading
+import time
 import traceback
 from pathlib import Path
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import functools
 from dotenv import load_dotenv
 from passlib.context import CryptContext
 import bcrypt
@@ -77,38 +85,166 @@ else:
     # Fallback to passlib
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# ==================== Password Hashing Service ====================
+# bcrypt is deliberately slow (~250 ms at cost 12), so every hash/verify runs on a
+# dedicated executor — a process pool sized to the cores by default — instead of on
+# the request thread. Once PASSWORD_HASH_MAX_QUEUE jobs are in flight new work is
+# refused with 503 + Retry-After, so a login burst degrades to fast rejections
+# rather than starving every other endpoint. Queue wait is exported on /health/hashing.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "process")  # process | thread
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", str(PASSWORD_HASH_WORKERS * 8)))
+
+
+class PasswordHashingBusy(HTTPException):
+    """Raised when the hashing queue is full; surfaces to clients as HTTP 503."""
+
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail="Server is busy. Please try again in a moment.",
+            headers={"Retry-After": "1"},
+        )
+
+
+def _bcrypt_hash_job(password_bytes: bytes, rounds: int):
+    return time.time(), bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _bcrypt_check_job(password_bytes: bytes, hashed_bytes: bytes):
+    return time.time(), bcrypt.checkpw(password_bytes, hashed_bytes)
+
+
+class _PasswordHasher:
+    """Bounded bcrypt executor. Jobs are module-level functions so they pickle
+    into the worker processes; each returns its start time so queue wait can be
+    measured across the process boundary."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._waits_ms = deque(maxlen=1000)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if PASSWORD_HASH_EXECUTOR == "process":
+                        # fork only: a spawned child would re-import main (DB setup and all)
+                        import multiprocessing
+                        from concurrent.futures import ProcessPoolExecutor
+                        try:
+                            self._executor = ProcessPoolExecutor(
+                                max_workers=PASSWORD_HASH_WORKERS,
+                                mp_context=multiprocessing.get_context("fork"),
+                            )
+                        except (OSError, ValueError) as e:
+                            print(f"[PasswordHasher] Process pool unavailable ({e}); using threads")
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt"
+                        )
+        return self._executor
+
+    def run(self, job, *args):
+        with self._lock:
+            if self._pending >= PASSWORD_HASH_MAX_QUEUE:
+                self._rejected += 1
+                raise PasswordHashingBusy()
+            self._pending += 1
+        submitted = time.time()
+        try:
+            try:
+                started, result = self._get_executor().submit(job, *args).result()
+            except Exception as e:
+                from concurrent.futures.process import BrokenProcessPool
+                if not isinstance(e, BrokenProcessPool):
+                    raise
+                # A worker died (OOM-killed etc.): start a fresh pool and retry once
+                with self._lock:
+                    self._executor = None
+                started, result = self._get_executor().submit(job, *args).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+        self._waits_ms.append(max(0.0, started - submitted) * 1000)
+        return result
+
+    def snapshot(self) -> dict:
+        waits = sorted(self._waits_ms)
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 2) if waits else 0.0
+
+        return {
+            "executor": PASSWORD_HASH_EXECUTOR,
+            "workers": PASSWORD_HASH_WORKERS,
+            "rounds": BCRYPT_ROUNDS,
+            "in_flight": self._pending,
+            "max_queue": PASSWORD_HASH_MAX_QUEUE,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "queue_wait_p50_ms": pct(0.50),
+            "queue_wait_p99_ms": pct(0.99),
+        }
+
+
+password_hasher = _PasswordHasher()
+
+
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
     # Validate password length (bcrypt limit is 72 bytes)
     password_bytes = password.encode('utf-8')
     if len(password_bytes) > 72:
         raise ValueError("Password cannot be longer than 72 bytes")
-    
-    try:
-        if USE_DIRECT_BCRYPT:
-            # Use direct bcrypt
-            salt = bcrypt.gensalt()
-            hashed = bcrypt.hashpw(password_bytes, salt)
-            result = hashed.decode('utf-8')
-        else:
-            # Use passlib
-            result = pwd_context.hash(password)
-        return result
-    except Exception as e:
-        raise
+
+    if USE_DIRECT_BCRYPT:
+        return password_hasher.run(_bcrypt_hash_job, password_bytes, BCRYPT_ROUNDS)
+    # Use passlib
+    return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
+    if USE_DIRECT_BCRYPT:
+        return password_hasher.run(
+            _bcrypt_check_job, plain_password.encode('utf-8'), hashed_password.encode('utf-8')
+        )
+    # Use passlib
+    return pwd_context.verify(plain_password, hashed_password)
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True when a bcrypt hash was made with a cost other than BCRYPT_ROUNDS."""
     try:
-        if USE_DIRECT_BCRYPT:
-            # Use direct bcrypt
-            result = bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
-        else:
-            # Use passlib
-            result = pwd_context.verify(plain_password, hashed_password)
-        return result
-    except Exception as e:
-        raise
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+def verify_user_password(db, user, plain_password: str) -> bool:
+    """Check a login password against user.password, upgrading the stored value
+    when it is legacy plain text or was hashed at an outdated bcrypt cost."""
+    stored = user.password or ""
+    if stored.startswith('$2b$') or stored.startswith('$2a$'):
+        if not verify_password(plain_password, stored):
+            return False
+        if password_needs_rehash(stored):
+            try:
+                user.password = hash_password(plain_password)
+                db.commit()
+            except PasswordHashingBusy:
+                pass  # retried on the next login
+        return True
+    # Plain text password (legacy), check directly and upgrade to hash
+    if stored != plain_password:
+        return False
+    user.password = hash_password(plain_password)
+    db.commit()
+    return True
 
 # ==================== JWT Utilities ====================
 
@@ -119,7 +255,7 @@ def create_access_token(data: dict, jti: str = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     token_jti = jti if jti else str(uuid.uuid4())
-    to_encode.update({"exp": expire, "type": "access", "jti": token_jti})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow(), "type": "access", "jti": token_jti})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -128,7 +264,7 @@ def create_refresh_token(data: dict, jti: str = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     token_jti = jti if jti else str(uuid.uuid4())
-    to_encode.update({"exp": expire, "type": "refresh", "jti": token_jti})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow(), "type": "refresh", "jti": token_jti})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -142,155 +278,42 @@ def decode_token(token: str) -> dict:
 
 
 def _check_token_revoked(payload: dict, request: Request) -> None:
-    """Check token revocation list and per-user invalidation timestamp.
-    Raises HTTP 401 if the token has been revoked."""
-    jti = payload.get("jti")
+    """Check IDOR path access, token revocation list and per-user invalidation timestamp.
+    Raises HTTP 403 on an IDOR violation and HTTP 401 if the token has been revoked.
+    jwt_auth_middleware runs this once per request; get_current_user only falls back
+    to it when the middleware did not authenticate the request."""
     user_id = payload.get("sub")
     user_type = payload.get("user_type")
-    iat = payload.get("iat")
 
     # ==================== IDOR ENFORCEMENT ====================
-    # Globally protect resources based on user_type and IDs in path
-    import json
-    import re
-    
-    # DO NOT EXHAUST REQUEST BODY STREAM: we avoid reading body here to not break FastAPI request parsing
-    
-    def check_student_access(s_id):
-        # Student can only access their own data
-        if user_type == 'student' and str(user_id) != str(s_id):
-            return False
-            
-        # Coach can only access students in their batches
-        if user_type == 'coach':
-            db = SessionLocal()
-            try:
-                # Find batches the student is in
-                batches = db.query(BatchStudentDB).filter(BatchStudentDB.student_id == int(s_id)).all()
-                if not batches:
-                    return False
-                batch_ids = [b.batch_id for b in batches]
-                
-                # Check if coach is assigned to any of these batches
-                coach_batch = db.query(BatchCoachDB).filter(
-                    BatchCoachDB.coach_id == int(user_id), 
-                    BatchCoachDB.batch_id.in_(batch_ids)
-                ).first()
-                
-                legacy = db.query(BatchDB).filter(
-                    BatchDB.id.in_(batch_ids), 
-                    BatchDB.assigned_coach_id == int(user_id)
-                ).first()
-                
-                if not coach_batch and not legacy:
-                    return False
-            except Exception:
-                return False
-            finally:
-                db.close()
-        return True
-
-    def check_batch_access(b_id):
-        if user_type == 'student':
-            db = SessionLocal()
-            try:
-                enrolled = db.query(BatchStudentDB).filter(
-                    BatchStudentDB.batch_id == int(b_id), 
-                    BatchStudentDB.student_id == int(user_id)
-                ).first()
-                if not enrolled:
-                    return False
-            except Exception:
-                return False
-            finally:
-                db.close()
-        elif user_type == 'coach':
-            db = SessionLocal()
-            try:
-                coach_batch = db.query(BatchCoachDB).filter(
-                    BatchCoachDB.coach_id == int(user_id), 
-                    BatchCoachDB.batch_id == int(b_id)
-                ).first()
-                
-                legacy = db.query(BatchDB).filter(
-                    BatchDB.id == int(b_id), 
-                    BatchDB.assigned_coach_id == int(user_id)
-                ).first()
-                
-                if not coach_batch and not legacy:
-                    return False
-            except Exception:
-                return False
-            finally:
-                db.close()
-        return True
-
+    # Resource IDs come from the matched route template (see _RouteAuthTable);
+    # paths without student/batch/coach parameters skip this block entirely.
     if user_type != 'owner':
-        path = request.url.path
-        # Check student ID matching in path (e.g. /students/5, /attendance/student/5)
-        # Be careful not to match /students/ and then an action without ID
-        student_match = re.search(r'/(?:student|students)/(\d+)(?:/|$)', path)
-        if student_match:
-            s_id = student_match.group(1)
-            if not check_student_access(s_id):
+        route_auth = getattr(request.state, "route_auth", None)
+        if route_auth is None:
+            route_auth = route_auth_table.match(request.url.path, request.method)
+        for kind, resource_id in (route_auth[1] if route_auth else ()):
+            if kind == "student" and not _idor_student_allowed(user_type, user_id, resource_id):
                 raise HTTPException(status_code=403, detail="Access denied to this student resource")
-                
-        # Check batch ID matching in path (e.g. /batches/5, /attendance/batch/5)
-        batch_match = re.search(r'/(?:batch|batches)/(\d+)(?:/|$)', path)
-        if batch_match:
-            b_id = batch_match.group(1)
-            if not check_batch_access(b_id):
+            if kind == "batch" and not _idor_batch_allowed(user_type, user_id, resource_id):
                 raise HTTPException(status_code=403, detail="Access denied to this batch resource")
-                
-        # Check coach ID matching in path
-        coach_match = re.search(r'/(?:coach|coaches)/(\d+)(?:/|$)', path)
-        # Prevent coach from accessing other coach's data, unless allowed by some specific rule.
-        # But students can access coach data to view profile.
-        if coach_match and user_type == 'coach':
-            c_id = coach_match.group(1)
-            if str(user_id) != str(c_id):
+            # Students may view coach profiles; coaches only their own data
+            if kind == "coach" and user_type == 'coach' and str(user_id) != resource_id:
                 raise HTTPException(status_code=403, detail="Access denied to other coach data")
 
     # ==========================================================
 
 
-    # Fast path: check Redis blacklist before opening a DB connection
-    if jti and _sync_redis_client:
-        try:
-            if _sync_redis_client.get(f"revoked:{jti}"):
-                raise HTTPException(status_code=401, detail="Token has been revoked. Please log in again.")
-        except HTTPException:
-            raise
-        except Exception:
-            pass  # Redis unavailable — fall through to DB check
-
-    db = SessionLocal()
-    try:
-        # 1. Check per-token blacklist (for explicit logout)
-        if jti and db.query(RevokedTokenDB).filter(RevokedTokenDB.jti == jti).first():
-            raise HTTPException(status_code=401, detail="Token has been revoked. Please log in again.")
-
-        # 2. Check per-user invalidation timestamp (for password change)
-        if user_id and user_type and iat:
-            user = None
-            if user_type == "owner":
-                user = db.query(OwnerDB).filter(OwnerDB.id == int(user_id)).first()
-            elif user_type == "coach":
-                user = db.query(CoachDB).filter(CoachDB.id == int(user_id)).first()
-            elif user_type == "student":
-                user = db.query(StudentDB).filter(StudentDB.id == int(user_id)).first()
-
-            if user and user.jwt_invalidated_at is not None:
-                from datetime import timezone as _tz
-                invalidated_ts = user.jwt_invalidated_at.replace(tzinfo=_tz.utc).timestamp()
-                if iat < invalidated_ts:
-                    raise HTTPException(
-                        status_code=401,
-                        detail="Session expired due to password change. Please log in again."
-                    )
-    finally:
-        db.close()
-
+    # Revocation list (explicit logout) and per-user invalidation timestamp
+    # (password change / logout_all), answered from cache where possible
+    reason = _token_revocation_reason(payload)
+    if reason == "revoked":
+        raise HTTPException(status_code=401, detail="Token has been revoked. Please log in again.")
+    if reason == "invalidated":
+        raise HTTPException(
+            status_code=401,
+            detail="Session expired due to password change. Please log in again."
+        )
 
 
 def verify_coach_batch_access(coach_id: int, batch_id: int, db) -> bool:
@@ -330,10 +353,126 @@ def verify_coach_student_access(coach_id: int, student_id: int, db) -> bool:
     )
 
 
+# ==================== Buffered Audit / Login-History Writer ====================
+# Audit and login-history rows are queued in-process and bulk-inserted by a
+# background thread every LOG_WRITER_FLUSH_MS or LOG_WRITER_BATCH_SIZE rows, so
+# logins and audited mutations no longer pay an extra synchronous commit. When the
+# queue is full the row is written inline (and counted) rather than dropped.
+# LOG_WRITER_MODE=sync restores the old write-and-commit on the caller's session.
+LOG_WRITER_MODE = os.getenv("LOG_WRITER_MODE", "buffered")  # buffered | sync
+LOG_WRITER_FLUSH_MS = int(os.getenv("LOG_WRITER_FLUSH_MS", "500"))
+LOG_WRITER_BATCH_SIZE = int(os.getenv("LOG_WRITER_BATCH_SIZE", "200"))
+LOG_WRITER_MAX_QUEUE = int(os.getenv("LOG_WRITER_MAX_QUEUE", "10000"))
+
+
+_FLUSH_MARKER = object()
+
+
+class _BufferedLogWriter:
+    def __init__(self, mode: str = LOG_WRITER_MODE, flush_ms: int = LOG_WRITER_FLUSH_MS,
+                 batch_size: int = LOG_WRITER_BATCH_SIZE, max_queue: int = LOG_WRITER_MAX_QUEUE):
+        self.mode = mode
+        self.flush_ms = flush_ms
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.overflows = 0
+        self.failed = 0
+
+    def write(self, db, model, **values) -> None:
+        if self.mode == "sync":
+            db.add(model(**values))
+            db.commit()
+            return
+        values.setdefault("created_at", datetime.utcnow())
+        try:
+            self._queue.put_nowait((model, values))
+        except queue.Full:
+            self.overflows += 1
+            self._insert([(model, values)])
+            return
+        self._ensure_flusher()
+
+    def _ensure_flusher(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            taken = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_ms / 1000
+            while len(taken) < self.batch_size and taken[-1] is not _FLUSH_MARKER:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    taken.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            batch = [item for item in taken if item is not _FLUSH_MARKER]
+            if batch:
+                self._insert(batch)
+            for _ in taken:
+                self._queue.task_done()
+
+    def _insert(self, items) -> None:
+        from sqlalchemy import insert
+        grouped = defaultdict(list)
+        for model, values in items:
+            grouped[model].append(values)
+        db = SessionLocal()
+        try:
+            for model, rows in grouped.items():
+                db.execute(insert(model), rows)
+            db.commit()
+            self.written += len(items)
+        except Exception as e:
+            db.rollback()
+            self.failed += len(items)
+            print(f"[LogWriter] Failed to write {len(items)} row(s): {e}")
+        finally:
+            db.close()
+
+    def flush(self) -> None:
+        """Write everything queued so far; used on shutdown and by tests."""
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if items:
+            self._insert(items)
+            for _ in items:
+                self._queue.task_done()
+        if self._thread is not None and self._thread.is_alive():
+            # Cut short the batch the flusher is collecting and wait for it to land
+            self._queue.put(_FLUSH_MARKER)
+            self._queue.join()
+
+    def snapshot(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "overflows": self.overflows,
+            "failed": self.failed,
+        }
+
+
+log_writer = _BufferedLogWriter()
+
+
 def emit_audit_log(db, user_id, role, action, resource_type, resource_id=None, old_values=None, new_values=None, ip_address=None):
-    from datetime import datetime
     try:
-        log = AuditLogDB(
+        log_writer.write(
+            db, AuditLogDB,
             user_id=user_id,
             role=role,
             action=action,
@@ -341,26 +480,22 @@ def emit_audit_log(db, user_id, role, action, resource_type, resource_id=None, o
             resource_id=resource_id,
             old_values=old_values,
             new_values=new_values,
-            ip_address=ip_address
+            ip_address=ip_address,
         )
-        db.add(log)
-        db.commit()
     except Exception as e:
         print(f"[AuditLog] Err: {e}")
         db.rollback()
 
 def record_login_history(db, user_id, user_type, ip_address, user_agent, status):
-    from datetime import datetime
     try:
-        log = LoginHistoryDB(
+        log_writer.write(
+            db, LoginHistoryDB,
             user_id=user_id,
             user_type=user_type,
             ip_address=ip_address,
             user_agent=user_agent,
-            status=status
+            status=status,
         )
-        db.add(log)
-        db.commit()
     except Exception as e:
         print(f"[LoginHistory] Err: {e}")
         db.rollback()
@@ -399,6 +534,9 @@ def get_current_user(
     Usage: current_user: dict = Depends(get_current_user)
     Returns the decoded JWT payload with keys: sub, user_type, email, role, jti.
     '''
+    # jwt_auth_middleware already validated this exact token for the request
+    if getattr(request.state, "auth_token", None) == credentials.credentials:
+        return request.state.current_user
     payload = decode_token(credentials.credentials)
     if payload.get("type") != "access":
         raise HTTPException(status_code=401, detail="Invalid token type: expected access token")
@@ -453,6 +591,323 @@ ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 
+# ==================== A15: Authorization Membership Index ====================
+# The IDOR checks in the auth middleware only need three relations:
+#   coach -> batches   (batch_coaches + legacy batches.assigned_coach_id)
+#   batch -> students  (batch_students, any status)
+#   student -> batches (batch_students, any status)
+# Each worker keeps an in-memory snapshot of them so that an access decision is a
+# dict lookup instead of 2-3 queries per request. Write paths that change
+# enrollment or coach assignment call invalidate_membership_index(); the snapshot
+# is rebuilt lazily (3 set-based queries) on the next lookup.
+#
+# AUTHZ_INDEX_BACKEND=local  (default) — other workers pick up changes after
+#                            AUTHZ_INDEX_TTL_SECONDS.
+# AUTHZ_INDEX_BACKEND=redis  — a version counter in Redis is bumped on every
+#                            invalidation so all workers rebuild on their next lookup.
+#                            Falls back to the TTL while Redis is unreachable.
+AUTHZ_INDEX_BACKEND = os.getenv("AUTHZ_INDEX_BACKEND", "local").strip().lower()
+AUTHZ_INDEX_TTL_SECONDS = int(os.getenv("AUTHZ_INDEX_TTL_SECONDS", "30"))
+_AUTHZ_INDEX_VERSION_KEY = "authz:membership:version"
+_EMPTY_IDS: frozenset = frozenset()
+
+
+class _MembershipIndex:
+    """Per-worker snapshot of coach/batch/student memberships used for IDOR checks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._coach_batches: Dict[int, set] = {}
+        self._batch_students: Dict[int, set] = {}
+        self._student_batches: Dict[int, set] = {}
+        self._loaded = False
+        self._dirty = True
+        self._loaded_at = 0.0
+        self._version: Optional[str] = None
+
+    def invalidate(self) -> None:
+        self._dirty = True
+        if AUTHZ_INDEX_BACKEND == "redis" and _sync_redis_client:
+            try:
+                _sync_redis_client.incr(_AUTHZ_INDEX_VERSION_KEY)
+            except Exception:
+                pass  # Redis unavailable — other workers fall back to the TTL
+
+    def _shared_version(self) -> Optional[str]:
+        if AUTHZ_INDEX_BACKEND != "redis" or not _sync_redis_client:
+            return None
+        try:
+            return str(_sync_redis_client.get(_AUTHZ_INDEX_VERSION_KEY) or "0")
+        except Exception:
+            return None
+
+    def _is_stale(self, version: Optional[str]) -> bool:
+        if self._dirty or not self._loaded:
+            return True
+        if version is not None:
+            return version != self._version
+        return time.monotonic() - self._loaded_at > AUTHZ_INDEX_TTL_SECONDS
+
+    def _rebuild(self, version: Optional[str]) -> None:
+        # Clear the flag before reading so an invalidation that races with the
+        # rebuild marks the fresh snapshot dirty again.
+        self._dirty = False
+        coach_batches = defaultdict(set)
+        batch_students = defaultdict(set)
+        student_batches = defaultdict(set)
+        db = SessionLocal()
+        try:
+            for batch_id, student_id in db.query(BatchStudentDB.batch_id, BatchStudentDB.student_id):
+                batch_students[batch_id].add(student_id)
+                student_batches[student_id].add(batch_id)
+            for batch_id, coach_id in db.query(BatchCoachDB.batch_id, BatchCoachDB.coach_id):
+                coach_batches[coach_id].add(batch_id)
+            for batch_id, coach_id in db.query(BatchDB.id, BatchDB.assigned_coach_id).filter(
+                BatchDB.assigned_coach_id.isnot(None)
+            ):
+                coach_batches[coach_id].add(batch_id)
+        except Exception:
+            self._dirty = True
+            raise
+        finally:
+            db.close()
+        self._coach_batches = dict(coach_batches)
+        self._batch_students = dict(batch_students)
+        self._student_batches = dict(student_batches)
+        self._loaded = True
+        self._loaded_at = time.monotonic()
+        self._version = version
+
+    def _ensure_fresh(self) -> None:
+        version = self._shared_version()
+        if not self._is_stale(version):
+            return
+        with self._lock:
+            if self._is_stale(version):
+                self._rebuild(version)
+
+    def coach_can_access_batch(self, coach_id: int, batch_id: int) -> bool:
+        self._ensure_fresh()
+        return batch_id in self._coach_batches.get(coach_id, _EMPTY_IDS)
+
+    def coach_can_access_student(self, coach_id: int, student_id: int) -> bool:
+        self._ensure_fresh()
+        student_batches = self._student_batches.get(student_id, _EMPTY_IDS)
+        return not student_batches.isdisjoint(self._coach_batches.get(coach_id, _EMPTY_IDS))
+
+    def student_in_batch(self, student_id: int, batch_id: int) -> bool:
+        self._ensure_fresh()
+        return student_id in self._batch_students.get(batch_id, _EMPTY_IDS)
+
+
+membership_index = _MembershipIndex()
+
+
+def invalidate_membership_index() -> None:
+    """Call after any write that changes batch enrollment or coach assignment."""
+    membership_index.invalidate()
+
+
+def _idor_student_allowed(user_type: str, user_id, s_id) -> bool:
+    # Student can only access their own data
+    if user_type == 'student' and str(user_id) != str(s_id):
+        return False
+    # Coach can only access students in their batches
+    if user_type == 'coach':
+        try:
+            return membership_index.coach_can_access_student(int(user_id), int(s_id))
+        except Exception:
+            return False
+    return True
+
+
+def _idor_batch_allowed(user_type: str, user_id, b_id) -> bool:
+    try:
+        if user_type == 'student':
+            return membership_index.student_in_batch(int(user_id), int(b_id))
+        if user_type == 'coach':
+            return membership_index.coach_can_access_batch(int(user_id), int(b_id))
+    except Exception:
+        return False
+    return True
+
+# ==================== Token Revocation Cache ====================
+# Write-through cache for the two revocation checks done on every authenticated request:
+#   revoked:{jti}                   -> "1", TTL = remaining token lifetime
+#   jwt_inv:{user_type}:{user_id}   -> invalidation epoch seconds ("0" = never),
+#                                      TTL = refresh-token lifetime
+# Logout, logout_all, session revoke, refresh rotation and change-password write these
+# keys right after their DB commit. A miss on revoked:{jti} is only trusted while the
+# revoked:warm marker exists: warm_revocation_cache() copies every unexpired
+# revoked_tokens row into Redis and refreshes the marker at startup and every
+# REVOCATION_CACHE_WARM_SECONDS, so a write-through lost while Redis was down is
+# repaired on the next cycle. While Redis is unreachable both checks fall back to the DB.
+# Each worker also remembers the jtis it has seen revoked (an exact set — the list is
+# bounded by token lifetime, so a probabilistic filter would buy nothing), which
+# rejects repeat requests with a revoked token without any network round trip.
+REVOCATION_CACHE_WARM_SECONDS = int(os.getenv("REVOCATION_CACHE_WARM_SECONDS", "300"))
+_REVOCATION_WARM_KEY = "revoked:warm"
+_CACHE_MISS = object()
+_local_revoked_jtis: Dict[str, float] = {}  # jti -> token expiry (epoch seconds)
+
+
+def _revoked_key(jti: str) -> str:
+    return f"revoked:{jti}"
+
+
+def _user_invalidation_key(user_type: str, user_id) -> str:
+    return f"jwt_inv:{user_type}:{user_id}"
+
+
+def _to_epoch(value) -> float:
+    """Epoch seconds for a JWT NumericDate or a datetime (naive datetimes are UTC)."""
+    if isinstance(value, datetime):
+        from datetime import timezone as _tz
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=_tz.utc)
+        return value.timestamp()
+    return float(value)
+
+
+def cache_revoked_token(jti: str, expires_at) -> None:
+    """Write-through for a revoked_tokens row. Call after the DB commit."""
+    if not jti or expires_at is None:
+        return
+    exp_ts = _to_epoch(expires_at)
+    _local_revoked_jtis[jti] = exp_ts
+    if _sync_redis_client:
+        try:
+            _sync_redis_client.setex(_revoked_key(jti), max(1, int(exp_ts - time.time())), "1")
+        except Exception:
+            pass  # repaired by the next warm_revocation_cache() run
+
+
+def cache_user_invalidation(user_type: str, user_id, invalidated_at) -> None:
+    """Write-through for a user's jwt_invalidated_at (None = never invalidated)."""
+    if not _sync_redis_client or not user_type or user_id is None:
+        return
+    value = _to_epoch(invalidated_at) if invalidated_at is not None else 0
+    try:
+        _sync_redis_client.setex(
+            _user_invalidation_key(user_type, user_id),
+            REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+            str(value),
+        )
+    except Exception:
+        pass
+
+
+def _cached_token_revoked(jti: str) -> Optional[bool]:
+    """True/False when the cache can answer, None when the DB must be asked."""
+    exp_ts = _local_revoked_jtis.get(jti)
+    if exp_ts is not None and exp_ts > time.time():
+        return True
+    if not _sync_redis_client:
+        return None
+    try:
+        revoked, warm = _sync_redis_client.mget(_revoked_key(jti), _REVOCATION_WARM_KEY)
+    except Exception:
+        return None
+    if revoked:
+        _local_revoked_jtis[jti] = time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        return True
+    return False if warm else None
+
+
+def _cached_user_invalidation_ts(user_type: str, user_id):
+    """Invalidation epoch seconds, None when never invalidated, or _CACHE_MISS."""
+    if not _sync_redis_client:
+        return _CACHE_MISS
+    try:
+        value = _sync_redis_client.get(_user_invalidation_key(user_type, user_id))
+    except Exception:
+        return _CACHE_MISS
+    if value is None:
+        return _CACHE_MISS
+    return float(value) or None
+
+
+def _load_user_invalidation_ts(db, user_type: str, user_id) -> Optional[float]:
+    model = USER_MODELS.get(user_type)
+    if model is None:
+        return None
+    row = db.query(model.jwt_invalidated_at).filter(model.id == int(user_id)).first()
+    invalidated_at = row[0] if row else None
+    cache_user_invalidation(user_type, user_id, invalidated_at)  # read-through
+    return _to_epoch(invalidated_at) if invalidated_at is not None else None
+
+
+def _token_revocation_reason(payload: dict) -> Optional[str]:
+    """Return "revoked" (explicit logout), "invalidated" (password change / logout_all)
+    or None for a decoded token. Only opens a DB session for what the cache cannot answer."""
+    jti = payload.get("jti")
+    user_id = payload.get("sub")
+    user_type = payload.get("user_type")
+    iat = payload.get("iat")
+
+    revoked = _cached_token_revoked(jti) if jti else False
+    if revoked:
+        return "revoked"
+    invalidated_ts = None
+    if user_id and user_type and iat:
+        invalidated_ts = _cached_user_invalidation_ts(user_type, user_id)
+
+    if revoked is None or invalidated_ts is _CACHE_MISS:
+        db = SessionLocal()
+        try:
+            if revoked is None:
+                revoked = db.query(RevokedTokenDB.id).filter(RevokedTokenDB.jti == jti).first() is not None
+                if revoked:
+                    return "revoked"
+            if invalidated_ts is _CACHE_MISS:
+                invalidated_ts = _load_user_invalidation_ts(db, user_type, user_id)
+        finally:
+            db.close()
+
+    # iat has whole-second precision: tokens issued in the same second as the
+    # invalidation stay valid rather than rejecting a fresh post-change login.
+    if invalidated_ts is not None and iat < int(invalidated_ts):
+        return "invalidated"
+    return None
+
+
+def warm_revocation_cache() -> int:
+    """Copy unexpired revoked_tokens rows into Redis and refresh the revoked:warm marker."""
+    if not _sync_redis_client:
+        return 0
+    db = SessionLocal()
+    try:
+        rows = db.query(RevokedTokenDB.jti, RevokedTokenDB.expires_at).filter(
+            RevokedTokenDB.expires_at > datetime.utcnow()
+        ).all()
+    finally:
+        db.close()
+    now_ts = time.time()
+    try:
+        pipe = _sync_redis_client.pipeline(transaction=False)
+        for jti, expires_at in rows:
+            ttl = int(_to_epoch(expires_at) - now_ts)
+            if ttl > 0:
+                pipe.setex(_revoked_key(jti), ttl, "1")
+        pipe.setex(_REVOCATION_WARM_KEY, REVOCATION_CACHE_WARM_SECONDS * 2, "1")
+        pipe.execute()
+    except Exception as e:
+        print(f"[RevocationCache] Warm-up failed: {e}")
+        return 0
+    for jti, exp_ts in list(_local_revoked_jtis.items()):
+        if exp_ts <= now_ts:
+            _local_revoked_jtis.pop(jti, None)
+    return len(rows)
+
+
+async def _revocation_cache_warmer():
+    while True:
+        await asyncio.sleep(REVOCATION_CACHE_WARM_SECONDS)
+        try:
+            await asyncio.to_thread(warm_revocation_cache)
+        except Exception as e:
+            print(f"[RevocationCache] Warm-up error: {e}")
+
 # ── B5: Firebase initialization ──────────────────────────────────────────────
 # Set FIREBASE_SERVICE_ACCOUNT_PATH in .env to path of your serviceAccountKey.json
 # If not configured, push notifications are silently skipped (app still works).
@@ -532,7 +987,6 @@ def send_email(to_email: str, subject: str, html_content: str, plain_content: Op
 
 
 # ── Email OTP helpers ─────────────────────────────────────────────────────
-import random as _random
 
 _OTP_EXPIRY_MINUTES = 10
 _OTP_MAX_ATTEMPTS = 5
@@ -546,30 +1000,156 @@ def _mask_email(email: str) -> str:
     visible = local[:2] if len(local) >= 2 else local[:1]
     return f"{visible}***@{domain}"
 
+# OTPs are stored as HMAC-SHA256(key, pre_auth_token:email:code). Six digits under a
+# 5-attempt limit gain nothing from bcrypt's cost, and a keyed digest bound to the
+# session token cannot be brute-forced offline from a leaked row without the key.
+# Primary store is Redis (otp:{pre_auth_token} hash, native TTL, atomic attempt
+# counter); without Redis the email_otps table is used and expired rows are purged
+# whenever a new OTP is issued.
+import hashlib
+import hmac
+
+_OTP_HMAC_KEY = hashlib.sha256(
+    (os.getenv("OTP_HMAC_KEY") or f"otp:{SECRET_KEY}").encode("utf-8")
+).digest()
+
+
+def _otp_digest(pre_auth_token: str, email: str, otp_code: str) -> str:
+    message = f"{pre_auth_token}:{email}:{otp_code}".encode("utf-8")
+    return hmac.new(_OTP_HMAC_KEY, message, hashlib.sha256).hexdigest()
+
+
+def _otp_key(pre_auth_token: str) -> str:
+    return f"otp:{pre_auth_token}"
+
+
+def _otp_email_key(email: str) -> str:
+    return f"otp:email:{email}"
+
+
 def _generate_and_store_otp(db, email: str, user_type: str) -> str:
     """
-    Generates a 6-digit OTP, hashes it, persists it, and returns a pre_auth_token (UUID).
+    Generates a 6-digit OTP, stores its HMAC and returns (otp_code, pre_auth_token).
     Invalidates any previous OTP for the same email.
     """
-    # Delete any prior OTPs for this email
-    db.query(EmailOTPDB).filter(EmailOTPDB.email == email).delete()
-
-    otp_code = f"{_random.randint(0, 999999):06d}"
-    otp_hash = hash_password(otp_code)
+    otp_code = f"{secrets.randbelow(1000000):06d}"
     pre_auth_token = str(uuid.uuid4())
-    expires_at = datetime.utcnow() + timedelta(minutes=_OTP_EXPIRY_MINUTES)
+    digest = _otp_digest(pre_auth_token, email, otp_code)
+    ttl = _OTP_EXPIRY_MINUTES * 60
 
-    record = EmailOTPDB(
+    if _sync_redis_client:
+        try:
+            previous = _sync_redis_client.get(_otp_email_key(email))
+            pipe = _sync_redis_client.pipeline()
+            if previous:
+                pipe.delete(_otp_key(previous))
+            pipe.hset(_otp_key(pre_auth_token), mapping={
+                "email": email, "user_type": user_type, "digest": digest, "attempts": 0,
+            })
+            pipe.expire(_otp_key(pre_auth_token), ttl)
+            pipe.setex(_otp_email_key(email), ttl, pre_auth_token)
+            pipe.execute()
+            return otp_code, pre_auth_token
+        except Exception as e:
+            print(f"[OTP] Redis unavailable, storing OTP in DB: {e}")
+
+    # DB fallback: drop prior OTPs for this email and anything already expired
+    db.query(EmailOTPDB).filter(
+        or_(EmailOTPDB.email == email, EmailOTPDB.expires_at < datetime.utcnow())
+    ).delete(synchronize_session=False)
+    db.add(EmailOTPDB(
         email=email,
         user_type=user_type,
-        otp_hash=otp_hash,
+        otp_hash=digest,
         pre_auth_token=pre_auth_token,
-        expires_at=expires_at,
-    )
-    db.add(record)
+        expires_at=datetime.utcnow() + timedelta(seconds=ttl),
+    ))
     db.commit()
     return otp_code, pre_auth_token
 
+
+def _lookup_otp_session(db, email: str, pre_auth_token: str) -> Optional[str]:
+    """Return the user_type of a live OTP session, or None if missing/expired."""
+    if _sync_redis_client:
+        try:
+            data = _sync_redis_client.hgetall(_otp_key(pre_auth_token))
+            if data:
+                return data.get("user_type") if data.get("email") == email else None
+        except Exception:
+            pass
+    record = db.query(EmailOTPDB).filter(
+        EmailOTPDB.email == email,
+        EmailOTPDB.pre_auth_token == pre_auth_token,
+        EmailOTPDB.used == False,
+    ).first()
+    if not record:
+        return None
+    if record.expires_at.replace(tzinfo=None) < datetime.utcnow():
+        db.delete(record)
+        db.commit()
+        return None
+    return record.user_type
+
+
+def _check_otp(db, email: str, pre_auth_token: str, otp_code: str):
+    """Verify and consume an OTP. Returns (status, user_type, remaining_attempts)
+    with status one of: ok, invalid, expired, locked, mismatch."""
+    digest = _otp_digest(pre_auth_token, email, otp_code)
+
+    if _sync_redis_client:
+        key = _otp_key(pre_auth_token)
+        try:
+            # Count the attempt before comparing so parallel guesses cannot exceed the limit
+            pipe = _sync_redis_client.pipeline()
+            pipe.hincrby(key, "attempts", 1)
+            pipe.hgetall(key)
+            attempts, data = pipe.execute()
+        except Exception:
+            data = None
+        if data is not None:
+            if "digest" in data:
+                if data.get("email") != email:
+                    return "invalid", None, 0
+                if attempts > _OTP_MAX_ATTEMPTS:
+                    _sync_redis_client.delete(key)
+                    return "locked", None, 0
+                if hmac.compare_digest(data["digest"], digest):
+                    # delete() is the atomic consume: only one request can win it
+                    if _sync_redis_client.delete(key) != 1:
+                        return "invalid", None, 0
+                    return "ok", data.get("user_type"), 0
+                return "mismatch", None, _OTP_MAX_ATTEMPTS - attempts
+            # HINCRBY created a stub for an unknown/expired session — discard it
+            _sync_redis_client.delete(key)
+
+    record = db.query(EmailOTPDB).filter(
+        EmailOTPDB.email == email,
+        EmailOTPDB.pre_auth_token == pre_auth_token,
+        EmailOTPDB.used == False,
+    ).first()
+    if not record:
+        return "invalid", None, 0
+    if record.expires_at.replace(tzinfo=None) < datetime.utcnow():
+        db.delete(record)
+        db.commit()
+        return "expired", None, 0
+    if record.attempts >= _OTP_MAX_ATTEMPTS:
+        db.delete(record)
+        db.commit()
+        return "locked", None, 0
+    if record.otp_hash.startswith("$2"):
+        matched = verify_password(otp_code, record.otp_hash)  # issued before the HMAC switch
+    else:
+        matched = hmac.compare_digest(record.otp_hash, digest)
+    if not matched:
+        record.attempts += 1
+        db.commit()
+        return "mismatch", None, _OTP_MAX_ATTEMPTS - record.attempts
+    user_type = record.user_type
+    db.delete(record)
+    db.commit()
+    return "ok", user_type, 0
+
 def _send_otp_email(email: str, otp_code: str) -> None:
     """Sends the OTP via SendGrid (non-blocking — logs on failure)."""
     html = f"""
@@ -865,6 +1445,7 @@ def cleanup_inactive_records():
             db.delete(batch)
             
         db.commit()
+        invalidate_membership_index()
     except Exception as e:
         print(f"[Cleanup Error] {e}")
         db.rollback()
@@ -991,13 +1572,90 @@ class StudentDB(Base):
     failed_login_attempts = Column(Integer, default=0)
     locked_until = Column(DateTime(timezone=True), nullable=True)
 
+class IdentityDB(Base):
+    """Email -> account index over owners, coaches and students, so login and
+    password flows resolve an email with one indexed lookup instead of probing
+    three tables. (user_type, user_id) points at the row holding the password
+    hash; status/locked_until mirror its lock state. Maintained by the
+    _sync_identities flush hook below — never write to it directly."""
+    __tablename__ = "identities"
+    __table_args__ = (UniqueConstraint("user_type", "user_id", name="uq_identities_user"),)
+    id = Column(Integer, primary_key=True, index=True)
+    email = Column(String, nullable=False, index=True)
+    user_type = Column(String(20), nullable=False)  # 'owner', 'coach' or 'student'
+    user_id = Column(Integer, nullable=False)
+    status = Column(String, nullable=True)
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+
+USER_MODELS = {"owner": OwnerDB, "coach": CoachDB, "student": StudentDB}
+_IDENTITY_TYPES = {OwnerDB: "owner", CoachDB: "coach", StudentDB: "student"}
+_IDENTITY_FIELDS = ("email", "status", "locked_until")
+# Login precedence when one email exists in several account tables
+_IDENTITY_PRIORITY = {"owner": 0, "coach": 1, "student": 2}
+
+from sqlalchemy import event as _sa_event, inspect as _sa_inspect
+from sqlalchemy.orm import Session as _OrmSession
+
+
+@_sa_event.listens_for(_OrmSession, "after_flush")
+def _sync_identities(session, flush_context):
+    """Mirror owner/coach/student inserts, updates and deletes into identities
+    within the same transaction (after_flush, so new rows already have ids)."""
+    table = IdentityDB.__table__
+    statements = []
+    for obj in session.new:
+        user_type = _IDENTITY_TYPES.get(type(obj))
+        if user_type:
+            statements.append(table.insert().values(
+                user_type=user_type, user_id=obj.id,
+                **{f: getattr(obj, f) for f in _IDENTITY_FIELDS},
+            ))
+    for obj in session.dirty:
+        user_type = _IDENTITY_TYPES.get(type(obj))
+        if not user_type:
+            continue
+        attrs = _sa_inspect(obj).attrs
+        if any(attrs[f].history.has_changes() for f in _IDENTITY_FIELDS):
+            statements.append(table.update().where(
+                table.c.user_type == user_type, table.c.user_id == obj.id,
+            ).values(**{f: getattr(obj, f) for f in _IDENTITY_FIELDS}))
+    for obj in session.deleted:
+        user_type = _IDENTITY_TYPES.get(type(obj))
+        if user_type:
+            statements.append(table.delete().where(
+                table.c.user_type == user_type, table.c.user_id == obj.id,
+            ))
+    if statements:
+        conn = session.connection()
+        for stmt in statements:
+            conn.execute(stmt)
+
+
+def find_identity(db, email: str, preferred_type: Optional[str] = None):
+    """Resolve an email to its identity row with a single indexed query.
+    preferred_type wins when the email exists under several account types."""
+    rows = db.query(IdentityDB).filter(IdentityDB.email == email).all()
+    if not rows:
+        return None
+    for row in rows:
+        if row.user_type == preferred_type:
+            return row
+    return min(rows, key=lambda r: _IDENTITY_PRIORITY.get(r.user_type, len(_IDENTITY_PRIORITY)))
+
+
+def load_identity_user(db, identity, user_type: Optional[str] = None):
+    """Primary-key load of the account an identity points at (optionally only of one type)."""
+    if identity is None or (user_type and identity.user_type != user_type):
+        return None
+    return db.get(USER_MODELS[identity.user_type], identity.user_id)
+
 class EmailOTPDB(Base):
     """Stores short-lived OTPs for email verification during login (coaches + students)."""
     __tablename__ = "email_otps"
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, nullable=False, index=True)
     user_type = Column(String(20), nullable=False)  # 'coach' or 'student'
-    otp_hash = Column(String, nullable=False)        # bcrypt hash of the 6-digit OTP
+    otp_hash = Column(String, nullable=False)        # HMAC-SHA256 of the 6-digit OTP (see _otp_digest)
     pre_auth_token = Column(String(64), nullable=False, unique=True)  # UUID; proves creds were verified
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=False)
@@ -2093,6 +2751,26 @@ def migrate_database_schema(engine):
         if 'performance_skills' in tables:
             check_and_add_column(engine, 'performance_skills', 'created_at', 'TIMESTAMP WITH TIME ZONE', nullable=True, default_value='NOW()')
 
+        # Backfill the identities index for accounts created before it existed
+        # (idempotent; new accounts are mirrored by the _sync_identities hook)
+        if 'identities' in tables:
+            try:
+                with engine.begin() as conn:
+                    for user_type, table_name in (("owner", "owners"), ("coach", "coaches"), ("student", "students")):
+                        if table_name not in tables:
+                            continue
+                        conn.execute(text(f"""
+                            INSERT INTO identities (email, user_type, user_id, status, locked_until)
+                            SELECT u.email, '{user_type}', u.id, u.status, u.locked_until
+                            FROM {table_name} u
+                            WHERE NOT EXISTS (
+                                SELECT 1 FROM identities i
+                                WHERE i.user_type = '{user_type}' AND i.user_id = u.id
+                            )
+                        """))
+            except Exception as e:
+                print(f"Warning: Could not backfill identities: {e}")
+
         # Performance indexes (CREATE INDEX IF NOT EXISTS is idempotent)
         try:
             with engine.begin() as conn:
@@ -3561,6 +4239,69 @@ except ImportError:
     _REDIS_AVAILABLE = False
     print("Warning: redis package not installed.")
 
+# ==================== Blocking I/O Offload & Event-Loop Lag ====================
+# The app runs on a single event loop per worker. Any synchronous SQLAlchemy or
+# file call made directly from an `async def` middleware/handler freezes every
+# in-flight request until it returns. Async code must hand such work to
+# run_blocking(), which runs it on a bounded pool dedicated to that purpose, so
+# auth lookups never queue behind the request handlers in Starlette's own pool.
+BLOCKING_IO_THREADS = int(os.getenv("BLOCKING_IO_THREADS", "16"))
+LOOP_LAG_SAMPLE_SECONDS = float(os.getenv("LOOP_LAG_SAMPLE_SECONDS", "0.5"))
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "100"))
+_blocking_io_executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_THREADS, thread_name_prefix="blocking-io")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a synchronous callable on the blocking-I/O pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_io_executor, functools.partial(func, *args, **kwargs))
+
+
+class _LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed sleep.
+
+    Any lag beyond a millisecond or so means something blocked the loop.
+    Recent samples are kept so /health/loop can report percentiles."""
+
+    def __init__(self, window: int = 600):
+        self._samples = deque(maxlen=window)
+        self._max_ms = 0.0
+
+    def record(self, lag_ms: float) -> None:
+        self._samples.append(lag_ms)
+        self._max_ms = max(self._max_ms, lag_ms)
+        if lag_ms >= LOOP_LAG_WARN_MS:
+            print(f"[LoopLag] Event loop blocked for {lag_ms:.1f} ms")
+
+    def snapshot(self) -> dict:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"samples": 0}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))], 2)
+
+        return {
+            "samples": len(samples),
+            "last_ms": round(self._samples[-1], 2),
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+            "window_max_ms": round(samples[-1], 2),
+            "max_ms": round(self._max_ms, 2),
+            "interval_s": LOOP_LAG_SAMPLE_SECONDS,
+        }
+
+
+loop_lag_monitor = _LoopLagMonitor()
+
+
+async def _monitor_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_SAMPLE_SECONDS)
+        loop_lag_monitor.record(max(0.0, (loop.time() - started - LOOP_LAG_SAMPLE_SECONDS) * 1000))
+
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 redis_client = None
 # Sync Redis client used for O(1) JWT token blacklist checks in the auth middleware
@@ -3583,7 +4324,22 @@ async def lifespan(app: FastAPI):
     if not cache_initialized:
         FastAPICache.init(InMemoryBackend(), prefix="shuttler-cache")
         print("Cache: using in-memory backend (Redis not available)")
+    # Start every worker from a fresh membership snapshot
+    invalidate_membership_index()
+    route_auth_table.build(app.routes)
+    loop_lag_task = asyncio.create_task(_monitor_loop_lag())
+    revocation_warmer = None
+    if _sync_redis_client:
+        try:
+            print(f"[RevocationCache] Warmed {warm_revocation_cache()} revoked token(s)")
+        except Exception as e:
+            print(f"[RevocationCache] Warm-up failed: {e}")
+        revocation_warmer = asyncio.create_task(_revocation_cache_warmer())
     yield
+    loop_lag_task.cancel()
+    log_writer.flush()
+    if revocation_warmer:
+        revocation_warmer.cancel()
 
 app = FastAPI(title="Badminton Academy Management System", lifespan=lifespan)
 
@@ -3743,6 +4499,9 @@ _JWT_PUBLIC_PATHS: set = {
     "/owners/",
     "/health",
     "/health/redis",
+    "/health/loop",
+    "/health/hashing",
+    "/health/log-writer",
 }
 
 # Path *prefixes* that are public (checked with str.startswith)
@@ -3764,6 +4523,77 @@ _JWT_PUBLIC_PREFIXES: tuple = (
 )
 
 
+def _is_public_path(path: str, method: str) -> bool:
+    """Raw-path public check, used for templates at build time and for unrouted paths."""
+    if path in _JWT_PUBLIC_PATHS:
+        # Special-case: POST /owners/ is public (registration); other methods require auth
+        return not (path == "/owners/" and method != "POST")
+    return path.startswith(_JWT_PUBLIC_PREFIXES)
+
+
+class _RouteAuthTable:
+    """Authorization facts per route template, built once from app.routes.
+
+    Each entry records whether the route is public and which path parameters name
+    an IDOR-protected resource: a parameter right after a student(s)/batch(es)/
+    coach(es) segment, e.g. /attendance/batch/{batch_id}. Routes are bucketed by
+    their first path segment, so a request only tries the handful of templates
+    that could match it. match() returns (public, ((kind, id), ...)) with numeric
+    ids only, or None when no route matches (404/405, static mounts)."""
+
+    _RESOURCE_KINDS = {
+        "student": "student", "students": "student",
+        "batch": "batch", "batches": "batch",
+        "coach": "coach", "coaches": "coach",
+    }
+    _KIND_ORDER = {"student": 0, "batch": 1, "coach": 2}
+
+    def __init__(self):
+        self._buckets: Dict[str, list] = {}
+        self._built = False
+
+    def build(self, routes) -> None:
+        buckets = defaultdict(list)
+        for route in routes:
+            methods = getattr(route, "methods", None)
+            path_regex = getattr(route, "path_regex", None)
+            if not methods or path_regex is None:
+                continue  # mounts fall back to the raw-path rules
+            segments = route.path.strip("/").split("/")
+            resources = sorted(
+                (
+                    (self._RESOURCE_KINDS[prev], seg[1:-1].split(":")[0])
+                    for prev, seg in zip(segments, segments[1:])
+                    if prev in self._RESOURCE_KINDS and seg.startswith("{")
+                ),
+                key=lambda r: self._KIND_ORDER[r[0]],
+            )
+            public = all(_is_public_path(route.path, m) for m in methods)
+            key = "*" if segments[0].startswith("{") else segments[0]
+            buckets[key].append((path_regex, methods, public, tuple(resources)))
+        self._buckets = dict(buckets)
+        self._built = True
+
+    def match(self, path: str, method: str):
+        if not self._built:
+            self.build(app.routes)
+        first = path[1:].split("/", 1)[0]
+        for bucket in (self._buckets.get(first, ()), self._buckets.get("*", ())):
+            for path_regex, methods, public, resources in bucket:
+                m = path_regex.match(path)
+                if m is None or method not in methods:
+                    continue
+                if not resources:
+                    return public, ()
+                return public, tuple(
+                    (kind, m.group(name)) for kind, name in resources if m.group(name).isdecimal()
+                )
+        return None
+
+
+route_auth_table = _RouteAuthTable()
+
+
 @app.middleware("http")
 async def jwt_auth_middleware(request: Request, call_next):
     """Validate JWT Bearer token for all protected routes.
@@ -3777,19 +4607,14 @@ async def jwt_auth_middleware(request: Request, call_next):
     if method == "OPTIONS":
         return await call_next(request)
 
-    # 2. Allow exact public paths
-    if path in _JWT_PUBLIC_PATHS:
-        # Special-case: POST /owners/ is public (registration); other methods require auth
-        if path == "/owners/" and method != "POST":
-            pass  # fall through to token validation below
-        else:
-            return await call_next(request)
-
-    # 3. Allow public path prefixes
-    if any(path.startswith(prefix) for prefix in _JWT_PUBLIC_PREFIXES):
+    # 2. One route-table lookup gives both the public flag and the resource IDs
+    #    the IDOR checks need; unrouted paths use the raw public-path rules.
+    route_auth = route_auth_table.match(path, method)
+    request.state.route_auth = route_auth
+    if route_auth[0] if route_auth else _is_public_path(path, method):
         return await call_next(request)
 
-    # 4. Validate Bearer token
+    # 3. Validate Bearer token
     auth_header = request.headers.get("Authorization", "")
     if not auth_header.startswith("Bearer "):
         return JSONResponse(
@@ -3812,147 +4637,19 @@ async def jwt_auth_middleware(request: Request, call_next):
             content={"detail": "Invalid token type: expected access token."},
         )
 
-    # 5. Check per-token revocation (explicit logout)
-    jti = payload.get("jti")
-    user_id = payload.get("sub")
-    user_type = payload.get("user_type")
-    iat = payload.get("iat")
-
-    # ==================== IDOR ENFORCEMENT ====================
-    # Globally protect resources based on user_type and IDs in path
-    import json
-    import re
-    
-    # DO NOT EXHAUST REQUEST BODY STREAM: we avoid reading body here to not break FastAPI request parsing
-    
-    def check_student_access(s_id):
-        # Student can only access their own data
-        if user_type == 'student' and str(user_id) != str(s_id):
-            return False
-            
-        # Coach can only access students in their batches
-        if user_type == 'coach':
-            db = SessionLocal()
-            try:
-                # Find batches the student is in
-                batches = db.query(BatchStudentDB).filter(BatchStudentDB.student_id == int(s_id)).all()
-                if not batches:
-                    return False
-                batch_ids = [b.batch_id for b in batches]
-                
-                # Check if coach is assigned to any of these batches
-                coach_batch = db.query(BatchCoachDB).filter(
-                    BatchCoachDB.coach_id == int(user_id), 
-                    BatchCoachDB.batch_id.in_(batch_ids)
-                ).first()
-                
-                legacy = db.query(BatchDB).filter(
-                    BatchDB.id.in_(batch_ids), 
-                    BatchDB.assigned_coach_id == int(user_id)
-                ).first()
-                
-                if not coach_batch and not legacy:
-                    return False
-            except Exception:
-                return False
-            finally:
-                db.close()
-        return True
-
-    def check_batch_access(b_id):
-        if user_type == 'student':
-            db = SessionLocal()
-            try:
-                enrolled = db.query(BatchStudentDB).filter(
-                    BatchStudentDB.batch_id == int(b_id), 
-                    BatchStudentDB.student_id == int(user_id)
-                ).first()
-                if not enrolled:
-                    return False
-            except Exception:
-                return False
-            finally:
-                db.close()
-        elif user_type == 'coach':
-            db = SessionLocal()
-            try:
-                coach_batch = db.query(BatchCoachDB).filter(
-                    BatchCoachDB.coach_id == int(user_id), 
-                    BatchCoachDB.batch_id == int(b_id)
-                ).first()
-                
-                legacy = db.query(BatchDB).filter(
-                    BatchDB.id == int(b_id), 
-                    BatchDB.assigned_coach_id == int(user_id)
-                ).first()
-                
-                if not coach_batch and not legacy:
-                    return False
-            except Exception:
-                return False
-            finally:
-                db.close()
-        return True
-
-    if user_type != 'owner':
-        # Check student ID matching in path (e.g. /students/5, /attendance/student/5)
-        # Be careful not to match /students/ and then an action without ID
-        student_match = re.search(r'/(?:student|students)/(\d+)(?:/|$)', path)
-        if student_match:
-            s_id = student_match.group(1)
-            if not check_student_access(s_id):
-                return JSONResponse(status_code=403, content={"detail": "Access denied to this student resource"})
-                
-        # Check batch ID matching in path (e.g. /batches/5, /attendance/batch/5)
-        batch_match = re.search(r'/(?:batch|batches)/(\d+)(?:/|$)', path)
-        if batch_match:
-            b_id = batch_match.group(1)
-            if not check_batch_access(b_id):
-                return JSONResponse(status_code=403, content={"detail": "Access denied to this batch resource"})
-                
-        # Check coach ID matching in path
-        coach_match = re.search(r'/(?:coach|coaches)/(\d+)(?:/|$)', path)
-        # Prevent coach from accessing other coach's data, unless allowed by some specific rule.
-        # But students can access coach data to view profile.
-        if coach_match and user_type == 'coach':
-            c_id = coach_match.group(1)
-            if str(user_id) != str(c_id):
-                return JSONResponse(status_code=403, content={"detail": "Access denied to other coach data"})
-
-    # ==========================================================
-
-
-    db = SessionLocal()
+    # 4. IDOR path checks, per-token revocation (explicit logout) and
+    #    per-user invalidation timestamp (password change). These hit Redis
+    #    and the DB, so they run on the blocking-I/O pool, off the event loop.
     try:
-        if jti and db.query(RevokedTokenDB).filter(RevokedTokenDB.jti == jti).first():
-            return JSONResponse(
-                status_code=401,
-                content={"detail": "Token has been revoked. Please log in again."},
-            )
+        await run_blocking(_check_token_revoked, payload, request)
+    except HTTPException as exc:
+        return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
-        # 6. Check per-user invalidation timestamp (password change)
-        if user_id and user_type and iat:
-            _user = None
-            if user_type == "owner":
-                _user = db.query(OwnerDB).filter(OwnerDB.id == int(user_id)).first()
-            elif user_type == "coach":
-                _user = db.query(CoachDB).filter(CoachDB.id == int(user_id)).first()
-            elif user_type == "student":
-                _user = db.query(StudentDB).filter(StudentDB.id == int(user_id)).first()
-
-            if _user and _user.jwt_invalidated_at is not None:
-                from datetime import timezone as _tz
-                inv_ts = _user.jwt_invalidated_at.replace(tzinfo=_tz.utc).timestamp()
-                if iat < inv_ts:
-                    return JSONResponse(
-                        status_code=401,
-                        content={"detail": "Session expired due to password change. Please log in again."},
-                    )
-    finally:
-        db.close()
-
-    # 7. Attach user info to request state for downstream use
+    # 5. Attach the request-scoped auth context for downstream dependencies.
+    #    get_current_user reuses it when it sees the same bearer token, so the
+    #    checks above run once per request.
     request.state.current_user = payload
+    request.state.auth_token = token
     return await call_next(request)
 
 # ==================== CORS Middleware (must be registered last / outermost) ====================
@@ -4065,7 +4762,7 @@ async def video_stream_options():
     )
 
 @app.get("/video-stream/{filename}", dependencies=[Depends(get_current_user)])
-async def stream_video(filename: str, request: Request):
+def stream_video(filename: str, request: Request):
     file_path = resolve_safe_upload_path(filename)  # A14: path traversal protection
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="Video not found")
@@ -4133,7 +4830,7 @@ async def stream_video(filename: str, request: Request):
         )
 
 @app.post("/upload", dependencies=[Depends(require_owner)])
-async def upload_file(file: UploadFile = File(...)):
+def upload_file(file: UploadFile = File(...)):
     try:
         # A12: Enforce 5 MB size limit — check before reading content
         file.file.seek(0, 2)
@@ -4146,8 +4843,8 @@ async def upload_file(file: UploadFile = File(...)):
             )
 
         # A12: Validate MIME type via magic bytes — do NOT trust file.content_type or filename extension
-        header = await file.read(12)
-        await file.seek(0)
+        header = file.file.read(12)
+        file.file.seek(0)
         safe_ext = validate_image_magic_bytes(header)  # raises HTTP 400 for non-image types
 
         # A12: Server-generated UUID filename; original filename is discarded entirely
@@ -4295,6 +4992,7 @@ def delete_coach(coach_id: int):
         db.delete(coach)
         db.commit()
         invalidate_cache("coaches")
+        invalidate_membership_index()
         return {"message": "Coach deleted"}
     finally:
         db.close()
@@ -4335,20 +5033,18 @@ def unified_login(request: Request, login_data: UnifiedLoginRequest, db: Session
             
             return access_token, refresh_token
 
+        # One indexed identities lookup decides which account (if any) to load;
+        # owner > coach > student precedence is applied by find_identity.
+        identity = find_identity(db, login_data.email)
+        if identity is not None:
+            check_account_lock(identity)
+
         # 1. Try OwnerDB
-        owner = db.query(OwnerDB).filter(OwnerDB.email == login_data.email).first()
+        owner = load_identity_user(db, identity, "owner")
         if owner:
             check_account_lock(owner)
             # Verify password
-            password_valid = False
-            if owner.password.startswith('$2b$') or owner.password.startswith('$2a$'):
-                password_valid = verify_password(login_data.password, owner.password)
-            else:
-                # Plain text password (legacy), check directly and upgrade to hash
-                password_valid = (owner.password == login_data.password)
-                if password_valid:
-                    owner.password = hash_password(login_data.password)
-                    db.commit()
+            password_valid = verify_user_password(db, owner, login_data.password)
 
             if password_valid:
                 if owner.status == "inactive":
@@ -4379,19 +5075,11 @@ def unified_login(request: Request, login_data: UnifiedLoginRequest, db: Session
                 handle_failed_login(db, owner, "owner", request.client.host if request.client else None, request.headers.get("user-agent"))
 
         # 2. Try CoachDB
-        coach = db.query(CoachDB).filter(CoachDB.email == login_data.email).first()
+        coach = load_identity_user(db, identity, "coach")
         if coach:
             check_account_lock(coach)
             # Verify password
-            password_valid = False
-            if coach.password.startswith('$2b$') or coach.password.startswith('$2a$'):
-                password_valid = verify_password(login_data.password, coach.password)
-            else:
-                # Plain text password (legacy), check directly and upgrade to hash
-                password_valid = (coach.password == login_data.password)
-                if password_valid:
-                    coach.password = hash_password(login_data.password)
-                    db.commit()
+            password_valid = verify_user_password(db, coach, login_data.password)
 
             if password_valid:
                 if coach.status == "inactive":
@@ -4430,19 +5118,11 @@ def unified_login(request: Request, login_data: UnifiedLoginRequest, db: Session
                 handle_failed_login(db, coach, "coach", request.client.host if request.client else None, request.headers.get("user-agent"))
 
         # 3. Try StudentDB
-        student = db.query(StudentDB).filter(StudentDB.email == login_data.email).first()
+        student = load_identity_user(db, identity, "student")
         if student:
             check_account_lock(student)
             # Verify password
-            password_valid = False
-            if student.password.startswith('$2b$') or student.password.startswith('$2a$'):
-                password_valid = verify_password(login_data.password, student.password)
-            else:
-                # Plain text password (legacy), check directly and upgrade to hash
-                password_valid = (student.password == login_data.password)
-                if password_valid:
-                    student.password = hash_password(login_data.password)
-                    db.commit()
+            password_valid = verify_user_password(db, student, login_data.password)
 
             if password_valid:
                 if student.status == "inactive":
@@ -4509,39 +5189,16 @@ class OTPResendRequest(BaseModel):
 @limiter.limit("10/15minutes")
 def verify_otp(request: Request, body: OTPVerifyRequest, db: Session = Depends(get_db)):
     """Verify email OTP for coach/student login.  Returns JWT tokens on success."""
-    from datetime import datetime as _dt
-
-    record = db.query(EmailOTPDB).filter(
-        EmailOTPDB.email == body.email,
-        EmailOTPDB.pre_auth_token == body.pre_auth_token,
-        EmailOTPDB.used == False,
-    ).first()
-
-    if not record:
+    status, user_type, remaining = _check_otp(db, body.email, body.pre_auth_token, body.otp)
+    if status == "invalid":
         raise HTTPException(status_code=400, detail="Invalid or expired verification session. Please log in again.")
-
-    now = _dt.utcnow()
-    if record.expires_at.replace(tzinfo=None) < now:
-        db.delete(record)
-        db.commit()
+    if status == "expired":
         raise HTTPException(status_code=400, detail="OTP has expired. Please log in again.")
-
-    if record.attempts >= _OTP_MAX_ATTEMPTS:
-        db.delete(record)
-        db.commit()
+    if status == "locked":
         raise HTTPException(status_code=400, detail="Too many incorrect attempts. Please log in again.")
-
-    if not verify_password(body.otp, record.otp_hash):
-        record.attempts += 1
-        db.commit()
-        remaining = _OTP_MAX_ATTEMPTS - record.attempts
+    if status == "mismatch":
         raise HTTPException(status_code=400, detail=f"Incorrect OTP. {remaining} attempt(s) remaining.")
 
-    # OTP valid — mark as used
-    record.used = True
-    db.commit()
-
-    user_type = record.user_type
     ip = request.client.host if request.client else None
     ua = request.headers.get("user-agent")
 
@@ -4630,22 +5287,10 @@ def verify_otp(request: Request, body: OTPVerifyRequest, db: Session = Depends(g
 @limiter.limit("5/15minutes")
 def resend_otp(request: Request, body: OTPResendRequest, db: Session = Depends(get_db)):
     """Resend a login OTP. Requires the pre_auth_token from the original /auth/login call."""
-    record = db.query(EmailOTPDB).filter(
-        EmailOTPDB.email == body.email,
-        EmailOTPDB.pre_auth_token == body.pre_auth_token,
-        EmailOTPDB.used == False,
-    ).first()
-
-    if not record:
-        raise HTTPException(status_code=400, detail="Invalid session. Please log in again.")
-
-    from datetime import datetime as _dt
-    if record.expires_at.replace(tzinfo=None) < _dt.utcnow():
-        db.delete(record)
-        db.commit()
-        raise HTTPException(status_code=400, detail="Session expired. Please log in again.")
+    user_type = _lookup_otp_session(db, body.email, body.pre_auth_token)
+    if not user_type:
+        raise HTTPException(status_code=400, detail="Invalid or expired session. Please log in again.")
 
-    user_type = record.user_type
     otp_code, new_pre_auth_token = _generate_and_store_otp(db, body.email, user_type)
     _send_otp_email(body.email, otp_code)
     return {"success": True, "pre_auth_token": new_pre_auth_token, "masked_email": _mask_email(body.email)}
@@ -4663,17 +5308,7 @@ def login_coach(request: Request, login_data: CoachLogin):
         
         if coach:
             # Verify password (supports both hashed and plain text for backward compatibility)
-            password_valid = False
-            if coach.password.startswith('$2b$') or coach.password.startswith('$2a$'):
-                # Password is hashed, verify it
-                password_valid = verify_password(login_data.password, coach.password)
-            else:
-                # Plain text password (legacy), check directly and upgrade to hash
-                password_valid = (coach.password == login_data.password)
-                if password_valid:
-                    # Upgrade to hashed password
-                    coach.password = hash_password(login_data.password)
-                    db.commit()
+            password_valid = verify_user_password(db, coach, login_data.password)
             
             if not password_valid:
                 return {
@@ -4719,30 +5354,12 @@ def forgot_password(request: Request, rq: ForgotPasswordRequest):
     """Request password reset - generates a reset token"""
     db = SessionLocal()
     try:
-        # Find user by email across all tables to determine user_type
-        user = None
-        user_type = request.user_type # Use provided as hint
+        # Resolve the account with one identities lookup; the provided
+        # user_type is only a hint for emails registered under several types
+        identity = find_identity(db, request_data.email, preferred_type=request_data.user_type)
+        user_type = identity.user_type if identity else None
 
-        # Try provided type first
-        if user_type == "coach":
-            user = db.query(CoachDB).filter(CoachDB.email == request_data.email).first()
-        elif user_type == "owner":
-            user = db.query(OwnerDB).filter(OwnerDB.email == request_data.email).first()
-        elif user_type == "student":
-            user = db.query(StudentDB).filter(StudentDB.email == request_data.email).first()
-        
-        # If not found, search all
-        if not user:
-            user = db.query(OwnerDB).filter(OwnerDB.email == request_data.email).first()
-            if user: user_type = "owner"
-            else:
-                user = db.query(CoachDB).filter(CoachDB.email == request_data.email).first()
-                if user: user_type = "coach"
-                else:
-                    user = db.query(StudentDB).filter(StudentDB.email == request_data.email).first()
-                    if user: user_type = "student"
-        
-        if not user:
+        if identity is None:
             return {"success": True, "message": "If your email is registered, you will receive a password reset token."}
         
         import hashlib
@@ -4858,141 +5475,23 @@ def refresh_access_token(request: Request, body: TokenRefreshRequest):
     if payload.get("type") != "refresh":
         raise HTTPException(status_code=401, detail="Invalid token type: expected refresh token")
 
-    # Check if refresh token has been explicitly revoked
     jti = payload.get("jti")
     user_id = payload.get("sub")
     user_type = payload.get("user_type")
-    iat = payload.get("iat")
-
-    # ==================== IDOR ENFORCEMENT ====================
-    # Globally protect resources based on user_type and IDs in path
-    import json
-    import re
-    
-    # DO NOT EXHAUST REQUEST BODY STREAM: we avoid reading body here to not break FastAPI request parsing
-    
-    def check_student_access(s_id):
-        # Student can only access their own data
-        if user_type == 'student' and str(user_id) != str(s_id):
-            return False
-            
-        # Coach can only access students in their batches
-        if user_type == 'coach':
-            db = SessionLocal()
-            try:
-                # Find batches the student is in
-                batches = db.query(BatchStudentDB).filter(BatchStudentDB.student_id == int(s_id)).all()
-                if not batches:
-                    return False
-                batch_ids = [b.batch_id for b in batches]
-                
-                # Check if coach is assigned to any of these batches
-                coach_batch = db.query(BatchCoachDB).filter(
-                    BatchCoachDB.coach_id == int(user_id), 
-                    BatchCoachDB.batch_id.in_(batch_ids)
-                ).first()
-                
-                legacy = db.query(BatchDB).filter(
-                    BatchDB.id.in_(batch_ids), 
-                    BatchDB.assigned_coach_id == int(user_id)
-                ).first()
-                
-                if not coach_batch and not legacy:
-                    return False
-            except Exception:
-                return False
-            finally:
-                db.close()
-        return True
-
-    def check_batch_access(b_id):
-        if user_type == 'student':
-            db = SessionLocal()
-            try:
-                enrolled = db.query(BatchStudentDB).filter(
-                    BatchStudentDB.batch_id == int(b_id), 
-                    BatchStudentDB.student_id == int(user_id)
-                ).first()
-                if not enrolled:
-                    return False
-            except Exception:
-                return False
-            finally:
-                db.close()
-        elif user_type == 'coach':
-            db = SessionLocal()
-            try:
-                coach_batch = db.query(BatchCoachDB).filter(
-                    BatchCoachDB.coach_id == int(user_id), 
-                    BatchCoachDB.batch_id == int(b_id)
-                ).first()
-                
-                legacy = db.query(BatchDB).filter(
-                    BatchDB.id == int(b_id), 
-                    BatchDB.assigned_coach_id == int(user_id)
-                ).first()
-                
-                if not coach_batch and not legacy:
-                    return False
-            except Exception:
-                return False
-            finally:
-                db.close()
-        return True
-
-    if user_type != 'owner':
-        # Check student ID matching in path (e.g. /students/5, /attendance/student/5)
-        # Be careful not to match /students/ and then an action without ID
-        student_match = re.search(r'/(?:student|students)/(\d+)(?:/|$)', path)
-        if student_match:
-            s_id = student_match.group(1)
-            if not check_student_access(s_id):
-                return JSONResponse(status_code=403, content={"detail": "Access denied to this student resource"})
-                
-        # Check batch ID matching in path (e.g. /batches/5, /attendance/batch/5)
-        batch_match = re.search(r'/(?:batch|batches)/(\d+)(?:/|$)', path)
-        if batch_match:
-            b_id = batch_match.group(1)
-            if not check_batch_access(b_id):
-                return JSONResponse(status_code=403, content={"detail": "Access denied to this batch resource"})
-                
-        # Check coach ID matching in path
-        coach_match = re.search(r'/(?:coach|coaches)/(\d+)(?:/|$)', path)
-        # Prevent coach from accessing other coach's data, unless allowed by some specific rule.
-        # But students can access coach data to view profile.
-        if coach_match and user_type == 'coach':
-            c_id = coach_match.group(1)
-            if str(user_id) != str(c_id):
-                return JSONResponse(status_code=403, content={"detail": "Access denied to other coach data"})
-
-    # ==========================================================
-
     exp = payload.get("exp")
 
+    # Explicit revocation (logout / earlier rotation) and password-change invalidation
+    reason = _token_revocation_reason(payload)
+    if reason == "revoked":
+        raise HTTPException(status_code=401, detail="Refresh token has been revoked. Please log in again.")
+    if reason == "invalidated":
+        raise HTTPException(
+            status_code=401,
+            detail="Session expired due to password change. Please log in again."
+        )
+
     db = SessionLocal()
     try:
-        if jti and db.query(RevokedTokenDB).filter(RevokedTokenDB.jti == jti).first():
-            raise HTTPException(status_code=401, detail="Refresh token has been revoked. Please log in again.")
-
-        # Check per-user invalidation (password change)
-        if user_id and user_type and iat:
-            _user = None
-            if user_type == "owner":
-                _user = db.query(OwnerDB).filter(OwnerDB.id == int(user_id)).first()
-            elif user_type == "coach":
-                _user = db.query(CoachDB).filter(CoachDB.id == int(user_id)).first()
-            elif user_type == "student":
-                _user = db.query(StudentDB).filter(StudentDB.id == int(user_id)).first()
-
-            if _user and _user.jwt_invalidated_at is not None:
-                from datetime import timezone as _tz
-                inv_ts = _user.jwt_invalidated_at.replace(tzinfo=_tz.utc).timestamp()
-                if iat < inv_ts:
-                    raise HTTPException(
-                        status_code=401,
-                        detail="Session expired due to password change. Please log in again."
-                    )
-
         # Revoke the consumed refresh token (token rotation)
         if jti and exp:
             from datetime import timezone as _tz
@@ -5004,6 +5503,7 @@ def refresh_access_token(request: Request, body: TokenRefreshRequest):
                 expires_at=expires_dt,
             ))
             db.commit()
+            cache_revoked_token(jti, exp)
 
     finally:
         db.close()
@@ -5125,6 +5625,8 @@ def revoke_session(session_id: int, current_user: dict = Depends(get_current_use
         
         session.is_revoked = True
         db.commit()
+        cache_revoked_token(session.jti, session.expires_at)
+        cache_revoked_token(session.refresh_jti, session.expires_at)
         
         return {"success": True, "message": "Session revoked successfully"}
     finally:
@@ -5149,9 +5651,9 @@ def logout_all_devices(current_user: dict = Depends(get_current_user)):
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
             
-        from sqlalchemy.sql import func
-        user.jwt_invalidated_at = func.now()
+        user.jwt_invalidated_at = datetime.utcnow()
         db.commit()
+        cache_user_invalidation(user_type, user_id, user.jwt_invalidated_at)
         
         return {"success": True, "message": "Successfully logged out from all devices"}
     finally:
@@ -5168,6 +5670,7 @@ def logout(body: LogoutRequest, credentials: HTTPAuthorizationCredentials = Secu
         raise HTTPException(status_code=401, detail="Invalid token type")
 
     db = SessionLocal()
+    revoked = []  # (jti, exp) pairs to push to the revocation cache after commit
     try:
         from datetime import timezone as _tz
 
@@ -5183,6 +5686,8 @@ def logout(body: LogoutRequest, credentials: HTTPAuthorizationCredentials = Secu
                 user_type=a_utype,
                 expires_at=datetime.fromtimestamp(a_exp, tz=_tz.utc),
             ))
+        if a_jti and a_exp:
+            revoked.append((a_jti, a_exp))
 
         # Optionally revoke refresh token
         if body.refresh_token:
@@ -5199,38 +5704,24 @@ def logout(body: LogoutRequest, credentials: HTTPAuthorizationCredentials = Secu
                         user_type=r_utype,
                         expires_at=datetime.fromtimestamp(r_exp, tz=_tz.utc),
                     ))
-                    if _sync_redis_client and r_jti and r_exp:
-                        try:
-                            r_ttl = max(1, int(r_exp - datetime.utcnow().timestamp()))
-                            _sync_redis_client.setex(f"revoked:{r_jti}", r_ttl, "1")
-                        except Exception:
-                            pass
+                if r_jti and r_exp:
+                    revoked.append((r_jti, r_exp))
             except JWTError:
                 pass  # Invalid refresh token — still succeed, just skip revoking it
 
-        # Cache access token revocation in Redis for O(1) future blacklist checks
-        if _sync_redis_client and a_jti and a_exp:
-            try:
-                a_ttl = max(1, int(a_exp - datetime.utcnow().timestamp()))
-                _sync_redis_client.setex(f"revoked:{a_jti}", a_ttl, "1")
-            except Exception:
-                pass
-
         db.commit()
     finally:
         db.close()
 
+    for jti, exp in revoked:
+        cache_revoked_token(jti, exp)
+
     return {"success": True, "message": "Logged out successfully"}
 
 
 @app.get("/auth/me")
-def get_current_user_profile(credentials: HTTPAuthorizationCredentials = Security(security)):
+def get_current_user_profile(payload: dict = Depends(get_current_user)):
     """Return the profile of the currently authenticated user."""
-    payload = decode_token(credentials.credentials)
-    if payload.get("type") != "access":
-        raise HTTPException(status_code=401, detail="Invalid token type")
-    _check_token_revoked(payload)
-
     user_id = payload.get("sub")
     user_type = payload.get("user_type")
 
@@ -5343,8 +5834,15 @@ def change_password(request: ChangePasswordRequest):
         user.password = hash_password(request.new_password)
         user.jwt_invalidated_at = datetime.utcnow()
         db.commit()
+        cache_user_invalidation(
+            request.user_type if request.user_type in ("coach", "owner") else "student",
+            user.id, user.jwt_invalidated_at,
+        )
 
         return {"success": True, "message": "Password changed successfully. Please log in again on all devices."}
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         return {"success": False, "message": f"Failed to change password: {str(e)}"}
@@ -5505,15 +6003,7 @@ def login_owner(login_data: OwnerLogin):
         if owner:
             check_account_lock(owner)
             # Verify password
-            password_valid = False
-            if owner.password.startswith('$2b$') or owner.password.startswith('$2a$'):
-                password_valid = verify_password(login_data.password, owner.password)
-            else:
-                # Plain text password (legacy), check directly and upgrade to hash
-                password_valid = (owner.password == login_data.password)
-                if password_valid:
-                    owner.password = hash_password(login_data.password)
-                    db.commit()
+            password_valid = verify_user_password(db, owner, login_data.password)
             
             if not password_valid:
                 return {
@@ -5626,6 +6116,7 @@ def _sync_batch_coaches(db, batch_id: int, coach_ids: Optional[List[int]]):
                 db.add(db_assignment)
     
     db.commit()
+    invalidate_membership_index()
 
 def _get_batch_coaches(db, batch_id: int) -> List[CoachInfo]:
     """Helper function to get coaches assigned to a batch"""
@@ -6097,6 +6588,7 @@ def delete_batch(batch_id: int):
         db.delete(batch)
         db.commit()
         invalidate_cache("batches")
+        invalidate_membership_index()
         return {"message": "Batch deleted"}
     finally:
         db.close()
@@ -6114,6 +6606,7 @@ def deactivate_batch(batch_id: int):
         batch.inactive_at = datetime.now()
         db.commit()
         invalidate_cache("batches")
+        invalidate_membership_index()
         return {"message": "Batch deactivated successfully"}
     finally:
         db.close()
@@ -6131,6 +6624,7 @@ def activate_batch(batch_id: int):
         batch.inactive_at = None
         db.commit()
         invalidate_cache("batches")
+        invalidate_membership_index()
         return {"message": "Batch activated successfully"}
     finally:
         db.close()
@@ -6156,6 +6650,7 @@ def remove_batch_permanently(batch_id: int):
         db.delete(batch)
         db.commit()
         invalidate_cache("batches")
+        invalidate_membership_index()
         return {"message": "Batch and all related records deleted permanently"}
     finally:
         db.close()
@@ -6204,8 +6699,7 @@ def assign_student_to_batch(batch_id: int, student_id: int):
         )
         db.add(db_assignment)
         db.commit()
-        
-        db.commit()
+        invalidate_membership_index()
         
         # Notify Student
         try:
@@ -6241,6 +6735,7 @@ def remove_student_from_batch(batch_id: int, student_id: int):
         
         db.delete(assignment)
         db.commit()
+        invalidate_membership_index()
         
         return {"message": "Student removed successfully"}
     finally:
@@ -6485,6 +6980,7 @@ def remove_student_permanently(student_id: int):
         
         db.delete(student)
         db.commit()
+        invalidate_membership_index()
         return {"message": "Student and all related records deleted permanently"}
     except Exception as e:
         db.rollback()
@@ -6541,26 +7037,16 @@ def login_student(login_data: StudentLogin):
         
         if student:
             # Verify password (supports both hashed and plain text for backward compatibility)
-            password_valid = False
-            if student.password.startswith('$2b$') or student.password.startswith('$2a$'):
-                # Password is hashed, verify it
-                password_valid = verify_password(login_data.password, student.password)
-            else:
-                # Plain text password (legacy), check directly and upgrade to hash
-                password_valid = (student.password == login_data.password)
-                if password_valid:
-                    # Upgrade to hashed password
-                    student.password = hash_password(login_data.password)
-                    db.commit()
+            password_valid = verify_user_password(db, student, login_data.password)
             
-                if student.status == "inactive":
-                    return {
-                        "success": False,
-                        "message": "Your account is currently inactive.",
-                        "account_inactive": True,
-                        "rejoin_request_pending": student.rejoin_request_pending,
-                        "student_id": student.id
-                    }
+            if password_valid and student.status == "inactive":
+                return {
+                    "success": False,
+                    "message": "Your account is currently inactive.",
+                    "account_inactive": True,
+                    "rejoin_request_pending": student.rejoin_request_pending,
+                    "student_id": student.id
+                }
                 
             if not password_valid:
                 return {
@@ -6633,6 +7119,7 @@ def assign_student_to_batch(assignment: BatchStudentAssign):
         db_assignment = BatchStudentDB(**assignment.model_dump(), status="approved")
         db.add(db_assignment)
         db.commit()
+        invalidate_membership_index()
         return {"message": "Student assigned to batch successfully"}
     finally:
         db.close()
@@ -6744,6 +7231,7 @@ def remove_student_from_batch(batch_id: int, student_id: int):
         
         db.delete(assignment)
         db.commit()
+        invalidate_membership_index()
         return {"message": "Student removed from batch"}
     finally:
         db.close()
@@ -9322,7 +9810,7 @@ def delete_tournament(tournament_id: int):
 # ==================== Video Resource Routes ====================
 
 @app.post("/video-resources/upload", dependencies=[Depends(require_coach)])
-async def upload_video(
+def upload_video(
     audience_type: str = Form("student"), # "all", "batch", "student"
     target_ids: Optional[str] = Form(None), # Comma-separated IDs
     title: Optional[str] = Form(None),
@@ -9967,6 +10455,7 @@ def update_invitation(invitation_id: int, invitation_update: InvitationUpdate):
                     db.add(db_assignment)
         
         db.commit()
+        invalidate_membership_index()
         db.refresh(invitation)
         return Invitation.model_validate(invitation)
     finally:
@@ -11737,7 +12226,7 @@ def check_coach_registration_status(email: str):
 
 @app.post("/api/upload/image", dependencies=[Depends(require_owner)])
 @limiter.limit("10/hour")
-async def upload_image(request: Request, file: UploadFile = File(...)):
+def upload_image(request: Request, file: UploadFile = File(...)):
     """Upload an image file (for profile photos, etc.). Accepts JPEG, PNG, WebP only; max 5 MB."""
     try:
         # A12: Enforce 5 MB size limit
@@ -11751,8 +12240,8 @@ async def upload_image(request: Request, file: UploadFile = File(...)):
             )
 
         # A12: Validate MIME type via magic bytes — do NOT trust file.content_type or filename extension
-        header = await file.read(12)
-        await file.seek(0)
+        header = file.file.read(12)
+        file.file.seek(0)
         safe_ext = validate_image_magic_bytes(header)  # raises HTTP 400 for non-image types
 
         # A12: Server-generated UUID filename; original filename is discarded entirely
@@ -11765,7 +12254,7 @@ async def upload_image(request: Request, file: UploadFile = File(...)):
 
         # Save to local disk as fallback if S3 is not configured
         file_path = UPLOAD_DIR / unique_filename
-        await file.seek(0)
+        file.file.seek(0)
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
         
@@ -11783,7 +12272,7 @@ async def upload_image(request: Request, file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/uploads/{filename}", dependencies=[Depends(require_owner)])
-async def get_uploaded_image(filename: str):
+def get_uploaded_image(filename: str):
     """Serve uploaded images"""
     file_path = resolve_safe_upload_path(filename)  # A14: path traversal protection
 
@@ -12519,14 +13008,16 @@ async def health_check():
     return {"status": "ok", "app": "shuttler", "version": "1.0.0"}
 
 @app.get("/health/db")
-async def db_health_check():
+def db_health_check():
     """Database connectivity health check"""
     from sqlalchemy import text
     try:
         # A simple query to check if DB is accessible
         db = SessionLocal()
-        db.execute(text("SELECT 1"))
-        db.close()
+        try:
+            db.execute(text("SELECT 1"))
+        finally:
+            db.close()
         return {"status": "ok", "database": "connected"}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Database connection failed: {str(e)}")
@@ -12544,6 +13035,21 @@ async def redis_health_check():
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Redis ping failed: {str(e)}")
 
+@app.get("/health/hashing")
+async def hashing_health_check():
+    """Password-hashing executor load and queue-wait percentiles"""
+    return {"status": "ok", "hashing": password_hasher.snapshot()}
+
+@app.get("/health/log-writer")
+async def log_writer_health_check():
+    """Buffered audit/login-history writer: queue depth, overflows and failures"""
+    return {"status": "ok", "log_writer": log_writer.snapshot()}
+
+@app.get("/health/loop")
+async def loop_health_check():
+    """Event-loop lag: how long the loop was blocked past a fixed sleep, in ms"""
+    return {"status": "ok", "loop_lag": loop_lag_monitor.snapshot()}
+
 # ==================== Server ====================
 
 if __name__ == "__main__":
@@ -1,3 +1,7 @@
+import os
+# Audit/login-history rows are written inline so tests can assert on them immediately
+os.environ.setdefault("LOG_WRITER_MODE", "sync")
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
@@ -0,0 +1,71 @@
+import pytest
+import main
+from main import create_access_token
+
+
+@pytest.fixture
+def owner_headers():
+    token = create_access_token({"sub": "1", "user_type": "owner", "email": "owner@test.com", "role": "owner"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def count_auth_checks(monkeypatch):
+    calls = []
+    original = main._check_token_revoked
+
+    def counting(payload, request):
+        calls.append(request.url.path)
+        return original(payload, request)
+
+    monkeypatch.setattr(main, "_check_token_revoked", counting)
+    return calls
+
+
+def test_protected_route_checks_token_once(client, owner_headers, count_auth_checks):
+    response = client.get("/students/", headers=owner_headers)
+    assert response.status_code == 200
+    assert count_auth_checks == ["/students/"]
+
+
+def test_auth_me_reuses_middleware_context(client, owner_headers, count_auth_checks):
+    response = client.get("/auth/me", headers=owner_headers)
+    assert response.status_code == 200
+    assert response.json()["email"] == "owner@test.com"
+    assert count_auth_checks == ["/auth/me"]
+
+
+def test_dependency_validates_when_middleware_skipped(client, owner_headers, count_auth_checks):
+    # "/" is a public path for the middleware but still requires an owner token
+    response = client.get("/", headers=owner_headers)
+    assert response.status_code == 200
+    assert count_auth_checks == ["/"]
+
+
+def test_auth_checks_run_off_the_event_loop(client, owner_headers, monkeypatch):
+    import threading
+    threads = []
+    original = main._check_token_revoked
+
+    def recording(payload, request):
+        threads.append(threading.current_thread().name)
+        return original(payload, request)
+
+    monkeypatch.setattr(main, "_check_token_revoked", recording)
+    assert client.get("/students/", headers=owner_headers).status_code == 200
+    assert threads and threads[0].startswith("blocking-io")
+
+
+def test_loop_lag_endpoint(client):
+    main.loop_lag_monitor.record(1.5)
+    response = client.get("/health/loop")
+    assert response.status_code == 200
+    assert response.json()["loop_lag"]["samples"] >= 1
+
+
+def test_coach_can_refresh_token(client):
+    from main import create_refresh_token
+    token = create_refresh_token({"sub": "1", "user_type": "coach", "email": "coach@test.com", "role": "coach"})
+    response = client.post("/auth/refresh", json={"refresh_token": token})
+    assert response.status_code == 200
+    assert "access_token" in response.json()
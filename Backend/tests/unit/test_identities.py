@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from main import CoachDB, StudentDB, IdentityDB, find_identity, load_identity_user
+
+
+def _identity(db, user_type, user_id):
+    return db.query(IdentityDB).filter(
+        IdentityDB.user_type == user_type, IdentityDB.user_id == user_id
+    ).first()
+
+
+def test_seeded_accounts_are_indexed(seeded_db):
+    identity = find_identity(seeded_db, "student1@test.com")
+    assert identity.user_type == "student"
+    student = load_identity_user(seeded_db, identity)
+    assert student.email == "student1@test.com"
+    assert load_identity_user(seeded_db, identity, "coach") is None
+    assert find_identity(seeded_db, "nobody@test.com") is None
+
+
+def test_identity_follows_create_update_delete(seeded_db):
+    coach = CoachDB(name="Temp", email="temp.coach@test.com", phone="1", password="x", status="active")
+    seeded_db.add(coach)
+    seeded_db.commit()
+    assert _identity(seeded_db, "coach", coach.id).email == "temp.coach@test.com"
+
+    coach.email = "renamed.coach@test.com"
+    coach.locked_until = datetime.utcnow() + timedelta(hours=1)
+    seeded_db.commit()
+    identity = _identity(seeded_db, "coach", coach.id)
+    seeded_db.refresh(identity)
+    assert identity.email == "renamed.coach@test.com"
+    assert identity.locked_until is not None
+
+    coach_id = coach.id
+    seeded_db.delete(coach)
+    seeded_db.commit()
+    assert _identity(seeded_db, "coach", coach_id) is None
+
+
+def test_precedence_and_type_hint(seeded_db):
+    # Same email registered as a coach and a student
+    student = StudentDB(name="Dup", email="coach@test.com", phone="1", password="x")
+    seeded_db.add(student)
+    seeded_db.commit()
+    try:
+        assert find_identity(seeded_db, "coach@test.com").user_type == "coach"
+        assert find_identity(seeded_db, "coach@test.com", preferred_type="student").user_type == "student"
+    finally:
+        seeded_db.delete(student)
+        seeded_db.commit()
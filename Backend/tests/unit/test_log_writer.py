@@ -0,0 +1,31 @@
+from main import _BufferedLogWriter, AuditLogDB, LoginHistoryDB
+
+
+def _history_count(db, status):
+    return db.query(LoginHistoryDB).filter(LoginHistoryDB.status == status).count()
+
+
+def test_buffered_rows_are_written_on_flush(seeded_db):
+    writer = _BufferedLogWriter(mode="buffered", flush_ms=60000, batch_size=1000)
+    before = _history_count(seeded_db, "buffered-test")
+    for i in range(5):
+        writer.write(seeded_db, LoginHistoryDB, user_id=i, user_type="coach",
+                     ip_address=None, user_agent=None, status="buffered-test")
+    writer.write(seeded_db, AuditLogDB, user_id=1, role="owner", action="TEST",
+                 resource_type="fee", resource_id=1, old_values={"a": 1}, new_values=None, ip_address=None)
+    writer.flush()
+    assert _history_count(seeded_db, "buffered-test") == before + 5
+    assert writer.snapshot()["written"] == 6
+    assert writer.snapshot()["queued"] == 0
+
+
+def test_overflow_is_written_inline_and_counted(seeded_db):
+    writer = _BufferedLogWriter(mode="buffered", flush_ms=60000, batch_size=1000, max_queue=1)
+    before = _history_count(seeded_db, "overflow-test")
+    writer._queue.put_nowait((LoginHistoryDB, {"user_id": 0, "status": "overflow-test"}))
+    writer.write(seeded_db, LoginHistoryDB, user_id=1, user_type="coach",
+                 ip_address=None, user_agent=None, status="overflow-test")
+    assert writer.overflows == 1
+    assert _history_count(seeded_db, "overflow-test") == before + 1
+    writer.flush()
+    assert _history_count(seeded_db, "overflow-test") == before + 2
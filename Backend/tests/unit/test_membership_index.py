@@ -0,0 +1,58 @@
+import pytest
+from main import (
+    BatchDB, BatchStudentDB, StudentDB, CoachDB,
+    membership_index, invalidate_membership_index,
+    _idor_student_allowed, _idor_batch_allowed,
+)
+
+
+@pytest.fixture
+def ids(seeded_db):
+    invalidate_membership_index()
+    batch = seeded_db.query(BatchDB).filter(BatchDB.batch_name == "Morning Batch").first()
+    coach = seeded_db.query(CoachDB).filter(CoachDB.email == "coach@test.com").first()
+    enrolled = seeded_db.query(StudentDB).filter(StudentDB.email == "student1@test.com").first()
+    private = seeded_db.query(StudentDB).filter(StudentDB.email == "student2@test.com").first()
+    return batch.id, coach.id, enrolled.id, private.id
+
+
+def test_coach_access_follows_batch_membership(ids):
+    batch_id, coach_id, enrolled_id, private_id = ids
+    assert membership_index.coach_can_access_batch(coach_id, batch_id)
+    assert membership_index.coach_can_access_student(coach_id, enrolled_id)
+    assert not membership_index.coach_can_access_student(coach_id, private_id)
+    assert not membership_index.coach_can_access_batch(coach_id + 100, batch_id)
+
+
+def test_student_batch_membership(ids):
+    batch_id, _, enrolled_id, private_id = ids
+    assert membership_index.student_in_batch(enrolled_id, batch_id)
+    assert not membership_index.student_in_batch(private_id, batch_id)
+
+
+def test_idor_helpers(ids):
+    batch_id, coach_id, enrolled_id, private_id = ids
+    assert _idor_student_allowed("student", enrolled_id, str(enrolled_id))
+    assert not _idor_student_allowed("student", enrolled_id, str(private_id))
+    assert _idor_batch_allowed("coach", str(coach_id), str(batch_id))
+    assert not _idor_batch_allowed("student", str(private_id), str(batch_id))
+    assert _idor_student_allowed("owner", 1, "999")
+    assert not _idor_batch_allowed("coach", "not-a-number", str(batch_id))
+
+
+def test_invalidation_picks_up_new_enrollment(seeded_db, ids):
+    batch_id, coach_id, _, private_id = ids
+    assert not membership_index.coach_can_access_student(coach_id, private_id)
+
+    assignment = BatchStudentDB(batch_id=batch_id, student_id=private_id, status="approved")
+    seeded_db.add(assignment)
+    seeded_db.commit()
+    try:
+        # Snapshot is still warm until a write path invalidates it
+        assert not membership_index.coach_can_access_student(coach_id, private_id)
+        invalidate_membership_index()
+        assert membership_index.coach_can_access_student(coach_id, private_id)
+    finally:
+        seeded_db.delete(assignment)
+        seeded_db.commit()
+        invalidate_membership_index()
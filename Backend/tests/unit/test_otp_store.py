@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+import main
+from main import EmailOTPDB, _generate_and_store_otp, _check_otp, _lookup_otp_session, _OTP_MAX_ATTEMPTS
+
+
+class FakeRedis:
+    """In-memory stand-in for the redis-py calls the OTP store makes (TTL ignored)."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = str(value)
+
+    def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hincrby(self, key, field, amount):
+        h = self.data.setdefault(key, {})
+        h[field] = str(int(h.get(field, 0)) + amount)
+        return int(h[field])
+
+    def expire(self, key, ttl):
+        return key in self.data
+
+    def delete(self, key):
+        return 1 if self.data.pop(key, None) is not None else 0
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+
+class _Pipeline:
+    def __init__(self, redis):
+        self.redis, self.calls = redis, []
+
+    def __getattr__(self, name):
+        return lambda *a, **kw: self.calls.append((name, a, kw))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*a, **kw) for name, a, kw in self.calls]
+
+
+@pytest.fixture(params=["redis", "db"])
+def store(request, monkeypatch, seeded_db):
+    monkeypatch.setattr(main, "_sync_redis_client", FakeRedis() if request.param == "redis" else None)
+    return request.param
+
+
+def test_correct_code_is_accepted_once(store, seeded_db):
+    code, token = _generate_and_store_otp(seeded_db, "otp@test.com", "coach")
+    assert _lookup_otp_session(seeded_db, "otp@test.com", token) == "coach"
+    assert _check_otp(seeded_db, "otp@test.com", token, code) == ("ok", "coach", 0)
+    assert _check_otp(seeded_db, "otp@test.com", token, code)[0] == "invalid"
+
+
+def test_wrong_codes_exhaust_attempts(store, seeded_db):
+    code, token = _generate_and_store_otp(seeded_db, "otp@test.com", "student")
+    wrong = f"{(int(code) + 1) % 1000000:06d}"
+    for used in range(1, _OTP_MAX_ATTEMPTS + 1):
+        assert _check_otp(seeded_db, "otp@test.com", token, wrong) == ("mismatch", None, _OTP_MAX_ATTEMPTS - used)
+    assert _check_otp(seeded_db, "otp@test.com", token, code)[0] == "locked"
+
+
+def test_new_otp_invalidates_previous(store, seeded_db):
+    code, token = _generate_and_store_otp(seeded_db, "otp@test.com", "coach")
+    _generate_and_store_otp(seeded_db, "otp@test.com", "coach")
+    assert _check_otp(seeded_db, "otp@test.com", token, code)[0] == "invalid"
+
+
+def test_other_email_cannot_use_session(store, seeded_db):
+    code, token = _generate_and_store_otp(seeded_db, "otp@test.com", "coach")
+    assert _check_otp(seeded_db, "someone@test.com", token, code)[0] == "invalid"
+
+
+def test_db_fallback_purges_expired_rows(monkeypatch, seeded_db):
+    monkeypatch.setattr(main, "_sync_redis_client", None)
+    seeded_db.add(EmailOTPDB(
+        email="stale@test.com", user_type="coach", otp_hash="x", pre_auth_token="stale-token",
+        expires_at=datetime.utcnow() - timedelta(minutes=1),
+    ))
+    seeded_db.commit()
+    _generate_and_store_otp(seeded_db, "otp@test.com", "coach")
+    assert seeded_db.query(EmailOTPDB).filter(EmailOTPDB.email == "stale@test.com").count() == 0
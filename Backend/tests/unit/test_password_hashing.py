@@ -0,0 +1,58 @@
+import bcrypt
+import pytest
+import main
+from main import (
+    PasswordHashingBusy, hash_password, verify_password,
+    password_needs_rehash, verify_user_password, password_hasher,
+)
+
+
+class FakeUser:
+    def __init__(self, password):
+        self.password = password
+
+
+class FakeSession:
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+
+@pytest.fixture(autouse=True)
+def cheap_rounds(monkeypatch):
+    monkeypatch.setattr(main, "BCRYPT_ROUNDS", 4)
+
+
+def test_hash_roundtrip_uses_configured_cost():
+    hashed = hash_password("secret-pass")
+    assert hashed.startswith("$2b$04$")
+    assert verify_password("secret-pass", hashed)
+    assert not verify_password("wrong", hashed)
+
+
+def test_outdated_cost_is_rehashed_on_login():
+    old = bcrypt.hashpw(b"secret-pass", bcrypt.gensalt(5)).decode()
+    assert password_needs_rehash(old)
+    user, db = FakeUser(old), FakeSession()
+    assert verify_user_password(db, user, "secret-pass")
+    assert user.password.startswith("$2b$04$") and db.commits == 1
+    assert verify_user_password(db, user, "secret-pass")
+    assert db.commits == 1
+
+
+def test_legacy_plain_text_is_upgraded():
+    user, db = FakeUser("plain"), FakeSession()
+    assert not verify_user_password(db, user, "other")
+    assert verify_user_password(db, user, "plain")
+    assert user.password.startswith("$2b$")
+
+
+def test_full_queue_is_rejected_with_503(monkeypatch):
+    monkeypatch.setattr(main, "PASSWORD_HASH_MAX_QUEUE", 0)
+    rejected = password_hasher.snapshot()["rejected"]
+    with pytest.raises(PasswordHashingBusy) as exc:
+        hash_password("secret-pass")
+    assert exc.value.status_code == 503
+    assert password_hasher.snapshot()["rejected"] == rejected + 1
@@ -0,0 +1,116 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import main
+from main import (
+    OwnerDB, RevokedTokenDB,
+    cache_revoked_token, cache_user_invalidation, warm_revocation_cache,
+    _token_revocation_reason,
+)
+
+
+class FakeRedis:
+    """Just enough of the redis-py sync API for the revocation cache."""
+
+    def __init__(self):
+        self.data = {}
+        self.calls = 0
+
+    def setex(self, key, ttl, value):
+        self.data[key] = str(value)
+
+    def get(self, key):
+        self.calls += 1
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        self.calls += 1
+        return [self.data.get(k) for k in keys]
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+
+@pytest.fixture
+def fake_redis(monkeypatch, seeded_db):
+    redis = FakeRedis()
+    monkeypatch.setattr(main, "_sync_redis_client", redis)
+    monkeypatch.setattr(main, "_local_revoked_jtis", {})
+    return redis
+
+
+@pytest.fixture
+def owner_payload(seeded_db):
+    owner = seeded_db.query(OwnerDB).first()
+    return {
+        "sub": str(owner.id), "user_type": "owner", "jti": str(uuid.uuid4()),
+        "iat": int(time.time()), "exp": int(time.time()) + 900,
+    }
+
+
+def test_warm_cache_answers_without_db(fake_redis, owner_payload, monkeypatch):
+    warm_revocation_cache()
+    cache_user_invalidation("owner", owner_payload["sub"], None)
+
+    def no_db():
+        raise AssertionError("DB should not be consulted on a warm cache")
+    monkeypatch.setattr(main, "SessionLocal", no_db)
+
+    assert _token_revocation_reason(owner_payload) is None
+
+
+def test_cold_cache_falls_back_to_db_and_reads_through(fake_redis, owner_payload):
+    assert _token_revocation_reason(owner_payload) is None
+    assert fake_redis.data[f"jwt_inv:owner:{owner_payload['sub']}"] == "0"
+
+
+def test_revoked_token_is_remembered_locally(fake_redis, owner_payload):
+    cache_revoked_token(owner_payload["jti"], owner_payload["exp"])
+    calls = fake_redis.calls
+    assert _token_revocation_reason(owner_payload) == "revoked"
+    assert fake_redis.calls == calls
+
+
+def test_warm_up_loads_revoked_rows(fake_redis, owner_payload, seeded_db):
+    row = RevokedTokenDB(
+        jti=owner_payload["jti"], user_id=int(owner_payload["sub"]), user_type="owner",
+        expires_at=datetime.utcnow() + timedelta(minutes=15),
+    )
+    seeded_db.add(row)
+    seeded_db.commit()
+    try:
+        warm_revocation_cache()
+        assert fake_redis.data[f"revoked:{owner_payload['jti']}"] == "1"
+        assert _token_revocation_reason(owner_payload) == "revoked"
+    finally:
+        seeded_db.delete(row)
+        seeded_db.commit()
+
+
+def test_invalidation_timestamp(fake_redis, owner_payload):
+    cache_user_invalidation("owner", owner_payload["sub"], datetime.utcnow() + timedelta(seconds=5))
+    assert _token_revocation_reason(owner_payload) == "invalidated"
+    cache_user_invalidation("owner", owner_payload["sub"], datetime.utcnow() - timedelta(minutes=5))
+    assert _token_revocation_reason(owner_payload) is None
+
+
+def test_no_redis_uses_db(monkeypatch, owner_payload, seeded_db):
+    monkeypatch.setattr(main, "_sync_redis_client", None)
+    monkeypatch.setattr(main, "_local_revoked_jtis", {})
+    assert _token_revocation_reason(owner_payload) is None
+    row = RevokedTokenDB(
+        jti=owner_payload["jti"], user_id=int(owner_payload["sub"]), user_type="owner",
+        expires_at=datetime.utcnow() + timedelta(minutes=15),
+    )
+    seeded_db.add(row)
+    seeded_db.commit()
+    try:
+        assert _token_revocation_reason(owner_payload) == "revoked"
+    finally:
+        seeded_db.delete(row)
+        seeded_db.commit()
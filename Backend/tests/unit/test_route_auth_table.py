@@ -0,0 +1,33 @@
+from main import app, _RouteAuthTable
+
+
+def table():
+    t = _RouteAuthTable()
+    t.build(app.routes)
+    return t
+
+
+def test_resource_params_come_from_route_templates():
+    t = table()
+    assert t.match("/students/5", "GET") == (False, (("student", "5"),))
+    assert t.match("/batches/3/students/7", "POST") == (False, (("student", "7"), ("batch", "3")))
+    assert t.match("/attendance/batch/2/date/2024-01-01", "GET") == (False, (("batch", "2"),))
+    assert t.match("/coaches/4", "GET") == (False, (("coach", "4"),))
+
+
+def test_routes_without_resource_ids_skip_idor():
+    t = table()
+    assert t.match("/students/", "GET") == (False, ())
+    assert t.match("/performance/grouped/coach/Ravi", "GET") == (False, ())
+
+
+def test_public_flags_match_whitelist():
+    t = table()
+    assert t.match("/auth/login", "POST")[0] is True
+    assert t.match("/owners/", "POST")[0] is True
+    assert t.match("/owners/", "GET")[0] is False
+    assert t.match("/invitations/student/a@b.com", "GET") == (True, ())
+
+
+def test_unrouted_paths_return_none():
+    assert table().match("/no-such-route/1", "GET") is None